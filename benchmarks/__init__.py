@@ -0,0 +1,4 @@
+"""ModReaderGui benchmarks - performance measurements for the readers
+
+use ``python -m benchmarks`` from the program directory, see run.py
+"""
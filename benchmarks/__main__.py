@@ -0,0 +1,5 @@
+"""ModReaderGui benchmarks startup
+"""
+import sys
+from benchmarks.run import main
+sys.exit(main())
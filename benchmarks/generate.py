@@ -0,0 +1,301 @@
+"""ModReaderGui benchmarks - synthetic music files
+
+every function writes a file of one of the supported types, filled with random (but
+reproducible) events; the size is determined by the number of patterns, tracks etc. asked for
+"""
+import random
+import struct
+import zlib
+import pathlib
+
+periods = [int(x) for x in """1712 1616 1524 1440 1356 1280 1208 1140 1076 1016  960  906
+ 856  808  762  720  678  640  604  570  538  508  480  453
+ 428  404  381  360  339  320  302  285  269  254  240  226
+ 214  202  190  180  170  160  151  143  135  127  120  113
+ 107  101   95   90   85   80   75   71   67   63   60   56""".split()]
+mod_signatures = {4: b'M.K.', 6: b'6CHN', 8: b'8CHN'}
+
+
+def make_mod(path, patterns=8, channels=4, songlen=16, seed=1):
+    """write a Protracker module
+
+    channels can be 4, 6 or 8; some patterns are cut short by a pattern break
+    """
+    rnd = random.Random(seed)
+    out = bytearray(b'benchmark'.ljust(20, b'\0'))
+    for i in range(31):
+        name = f'sample{i + 1}'.encode() if i < 8 else b''
+        out += name.ljust(22, b'\0') + struct.pack('>HBBHH', 100 if i < 8 else 0, 0, 64, 0, 1)
+    out += bytes([songlen, 127])
+    playseq = [rnd.randrange(patterns) for _ in range(songlen)]
+    playseq[0] = patterns - 1   # the highest pattern number has to be in there
+    out += bytes(playseq).ljust(128, b'\0')
+    out += mod_signatures[channels]
+    for _ in range(patterns):
+        pattern_break = rnd.choice([None, None, 16, 48, 40])
+        for row in range(64):
+            for channel in range(channels):
+                sample = period = effect = 0
+                if rnd.random() < 0.3:
+                    sample = rnd.randint(1, 8)
+                    period = rnd.choice(periods)
+                if rnd.random() < 0.05:
+                    effect = rnd.choice([1, 12, 15])
+                if row == pattern_break and channel == channels // 2:
+                    effect = 13
+                out += bytes([(sample & 0xF0) | (period >> 8), period & 0xFF,
+                              ((sample & 0x0F) << 4) | effect, 0])
+    pathlib.Path(path).write_bytes(out)
+
+
+def make_med(path, kind='MMD1', blocks=6, tracks=8, songlen=12, samples=6, seed=2):
+    """write an OctaMED module
+
+    kind is MMD0 (3-byte events) or MMD1 (4-byte events); the blocks have varying lengths
+    """
+    rnd = random.Random(seed)
+    # layout: header, song, block and sample pointers, expansion, annotation, instrument
+    # info and then the blocks
+    song_start = 52
+    blockarr = song_start + 788
+    smplarr = blockarr + 4 * blocks
+    expansion = smplarr + 4 * samples
+    annotation = expansion + 63
+    annotext = b'benchmark\0'
+    iinfo = annotation + len(annotext)
+    iinfo_len = 42
+    address = iinfo + samples * iinfo_len
+    blockstarts, blockdata = [], []
+    for _ in range(blocks):
+        lines = rnd.choice([32, 48, 64, 64, 128])
+        data = bytearray()
+        if kind == 'MMD0':
+            data += struct.pack('BB', tracks, lines - 1)
+        else:
+            data += struct.pack('>HHL', tracks, lines - 1, 0)
+        for _ in range(lines * tracks):
+            note = inst = 0
+            if rnd.random() < 0.3:
+                note = rnd.randint(1, 0x3F if kind == 'MMD0' else 0x7F)
+                inst = rnd.randint(1, samples)
+            if kind == 'MMD0':
+                data += bytes([note | ((inst << 2) & 0xC0), (inst & 0x0F) << 4, 0])
+            else:
+                data += bytes([note, inst, 0, 0])
+        blockstarts.append(address)
+        blockdata.append(data)
+        address += len(data)
+    out = bytearray(struct.pack('>4s9L4HhBB', kind.encode(), address, song_start, 0, blockarr,
+                                0, smplarr, 0, expansion, 0, 0, 0, 0, 0, 0, 0, 0))
+    playseq = [rnd.randrange(blocks) for _ in range(songlen)]
+    songinfo = ([0] * 504 + [blocks, songlen] + playseq + [0] * (256 - songlen) + [0] * 5
+                + [0] * 16 + [0, samples])
+    out += struct.pack('>504BHH256BHBbbb16bbb', *songinfo)
+    for start in blockstarts:
+        out += struct.pack('>L', start)
+    for i in range(samples):
+        out += struct.pack('>L', 0 if i == 2 else 1)    # one sample without data
+    out += struct.pack('>LLHHLLLHH7L7B', 0, 0, 0, 0, annotation, len(annotext), iinfo, samples,
+                       iinfo_len, *([0] * 14))
+    out += annotext
+    for i in range(samples):
+        out += f'instr{i + 1}'.encode().ljust(iinfo_len, b'\0')
+    for data in blockdata:
+        out += data
+    pathlib.Path(path).write_bytes(out)
+
+
+def make_xm(path, patterns=5, channels=8, instruments=6, songlen=10, seed=3):
+    """write a FastTracker II extended module
+
+    most of the events are packed, some patterns are cut short by a pattern break
+    """
+    rnd = random.Random(seed)
+    out = bytearray(b'Extended Module: ' + b'benchmark'.ljust(20, b'\0') + b'\x1a'
+                    + b'generate.py'.ljust(20, b' '))
+    out += struct.pack('BB', 4, 1)
+    out += struct.pack('<L8H', 276, songlen, 0, channels, patterns, instruments, 1, 6, 125)
+    out += bytes(rnd.randrange(patterns) for _ in range(songlen)).ljust(256, b'\0')
+    for _ in range(patterns):
+        rows = rnd.choice([16, 32, 48, 64, 128])
+        pattern_break = rnd.choice([None, None, rows // 2 + 3])
+        data = bytearray()
+        for row in range(rows):
+            for channel in range(channels):
+                note = inst = volume = effect = param = 0
+                if rnd.random() < 0.3:
+                    note = rnd.randint(1, 96)
+                    inst = rnd.randint(1, instruments)
+                if rnd.random() < 0.1:
+                    volume = rnd.randint(0x10, 0x50)
+                if rnd.random() < 0.05:
+                    effect = rnd.choice([1, 2, 12])
+                    param = rnd.randint(0, 255)
+                if row == pattern_break and channel == 1:
+                    effect = 13
+                event = (note, inst, volume, effect, param)
+                if rnd.random() < 0.2:
+                    data += bytes(event)
+                    continue
+                flags = 0x80 | sum(1 << i for i, x in enumerate(event) if x)
+                data += bytes([flags] + [x for x in event if x])
+        out += struct.pack('<LBHH', 9, 0, rows, len(data)) + data
+    for i in range(instruments):
+        name = f'inst{i + 1}' if i != 3 else ''     # one instrument named after its sample
+        out += struct.pack('<L', 33) + name.encode().ljust(22, b'\0')
+        out += struct.pack('<BHL', 0, 1, 40)
+        out += struct.pack('<LLLBBBBBB', 0, 0, 0, 64, 0, 0, 0, 0, 0)
+        out += f'samp{i + 1}.wav'.encode().ljust(22, b'\0')
+    pathlib.Path(path).write_bytes(out)
+
+
+def varlen(number):
+    """encode a number as a midi variable length quantity
+    """
+    result = [number & 0x7F]
+    number >>= 7
+    while number:
+        result.insert(0, (number & 0x7F) | 0x80)
+        number >>= 7
+    return bytes(result)
+
+
+def make_mid(path, tracks=4, bars=16, resolution=96, seed=4):
+    """write a standard midi file (format 1)
+
+    the last track plays on the drum channel; running status is used where possible
+    """
+    rnd = random.Random(seed)
+    chunks = [varlen(0) + b'\xff\x51\x03\x07\xa1\x20' + varlen(0) + b'\xff\x03' + varlen(4)
+              + b'Song' + varlen(0) + b'\xff\x2f\x00']
+    step = resolution // 4
+    for trackno in range(tracks):
+        channel = 9 if trackno == tracks - 1 else trackno
+        name = f'Track {trackno}'.encode()
+        data = bytearray(varlen(0) + b'\xff\x03' + varlen(len(name)) + name)
+        data += varlen(0) + bytes([0xC0 | channel, rnd.randint(0, 80)])
+        events = []
+        for tick in range(bars * 16):
+            if rnd.random() < 0.35:
+                if channel == 9:
+                    pitch = rnd.choice([36, 38, 42, 46, 49, 51])
+                else:
+                    pitch = rnd.randint(36, 84)
+                events.append((tick * step, 1, pitch, rnd.randint(40, 127)))
+                events.append((tick * step + step // 2, 0, pitch, 0))    # note on, velocity 0
+        events.sort(key=lambda x: x[:2])
+        now = 0
+        for ix, (when, _, pitch, velocity) in enumerate(events):
+            data += varlen(when - now)
+            now = when
+            data += bytes([pitch, velocity] if ix else [0x90 | channel, pitch, velocity])
+        data += varlen(0) + b'\xf0' + varlen(3) + b'\x7e\x7f\xf7'
+        data += varlen(0) + b'\xff\x2f\x00'
+        chunks.append(data)
+    out = b'MThd' + struct.pack('>LHHH', 6, 1, len(chunks), resolution)
+    for data in chunks:
+        out += b'MTrk' + struct.pack('>L', len(data)) + data
+    pathlib.Path(path).write_bytes(out)
+
+
+def make_rpp(path, tracks=3, patterns=6, events=100, seed=5):
+    """write a Reaper project with a midi item on every track
+
+    the last track plays on the drum channel; the item is divided into patterns by program
+    changes (like the reader expects), events is the number of notes per pattern
+    """
+    rnd = random.Random(seed)
+    lines = ['<REAPER_PROJECT 0.1 "6.0/linux64" 1600000000', '  TEMPO 120 4 4']
+    for trackno in range(tracks):
+        channel = 9 if trackno == tracks - 1 else trackno
+        lines += [f"  <TRACK '{{604D0845-C894-4422-B3F7-3CD51F61{trackno:04}}}'",
+                  f'    NAME "track {trackno}"', '    VOLPAN 1 0 -1 -1 1',
+                  '    <ITEM', '      POSITION 0', f'      NAME "item {trackno}"',
+                  '      <SOURCE MIDI', '        HASDATA 1 96 QN',
+                  f'        E 0 b{channel:x} 7b 00']
+        for pattno in range(patterns):
+            if pattno:
+                lines.append(f'        E {rnd.randint(0, 48)} c{channel:x} 05 00')
+            for _ in range(events):
+                if channel == 9:
+                    pitch = rnd.choice([36, 38, 42, 46])
+                else:
+                    pitch = rnd.randint(40, 80)
+                delta = rnd.choice([0, 24, 48, 96])
+                lines.append(f'        E {delta} 9{channel:x} {pitch:02x} 60')
+                lines.append(f'        E 12 8{channel:x} {pitch:02x} 00')
+                if rnd.random() < 0.1:
+                    lines.append(f'        e 0 9{channel:x} {pitch:02x} 60')   # muted
+        lines += ['        E 0 b0 7b 00', '      >', '    >', '  >']
+    lines.append('>')
+    pathlib.Path(path).write_text('\n'.join(lines) + '\n')
+
+
+def make_mmp(path, instruments=3, drums=3, patterns=4, seed=6, compress=False):
+    """write an LMMS project
+
+    besides the instrument tracks there is a beat/bassline track with the drums in it
+    with compress set the file is written the way LMMS writes an .mmpz file
+    """
+    rnd = random.Random(seed)
+    parts = ['<?xml version="1.0"?>', '<!DOCTYPE lmms-project>',
+             '<lmms-project version="1.0" creator="LMMS" type="song">',
+             '<head timesig_numerator="4" bpm="120"/>', '<song>', '<trackcontainer type="song">']
+    for instno in range(instruments):
+        parts.append(f'<track type="0" muted="0" name="inst{instno}">'
+                     '<instrumenttrack vol="100"/>')
+        for pattno in range(patterns):
+            start = pattno * 768 + rnd.choice([0, 192]) + instno * 600
+            parts.append(f'<pattern pos="{start}" len="384" name="p{pattno}">')
+            for noteno in range(rnd.randint(4, 30)):
+                parts.append(f'<note pos="{noteno * 12}" key="{rnd.randint(40, 70)}" len="12"'
+                             ' vol="100"/>')
+            parts.append('</pattern>')
+        parts.append('</track>')
+    parts.append('<track type="1" muted="0" name="Beat/Bassline 0"><bbtrack>'
+                 '<trackcontainer type="bbtrackcontainer">')
+    for drumno in range(drums):
+        parts.append(f'<track type="0" name="drum{drumno}"><instrumenttrack/>')
+        for _ in range(2):
+            parts.append('<pattern pos="0" len="192" name="">')
+            for _ in range(rnd.randint(1, 8)):
+                parts.append(f'<note pos="{rnd.randrange(16) * 12}" key="57" len="-192"'
+                             ' vol="100"/>')
+            parts.append('</pattern>')
+        parts.append('</track>')
+    parts.append('</trackcontainer></bbtrack>')
+    for pattno in range(patterns + 2):
+        parts.append(f'<bbtco pos="{pattno * 192}" len="192" name=""/>')
+    parts += ['</track>', '</trackcontainer>', '</song>', '</lmms-project>']
+    data = '\n'.join(parts).encode()
+    if compress:
+        data = struct.pack('>L', len(data)) + zlib.compress(data)
+    pathlib.Path(path).write_bytes(data)
+
+
+def generate(destdir, scale=1):
+    """write a set of files covering all supported types to the given directory
+
+    scale multiplies the length of the songs (as far as the file format allows)
+    returns the names of the files
+    """
+    destdir = pathlib.Path(destdir)
+    destdir.mkdir(parents=True, exist_ok=True)
+    makers = {'mod4.mod': (make_mod, {'patterns': min(8 * scale, 64),
+                                      'songlen': min(16 * scale, 128)}),
+              'mod8.mod': (make_mod, {'patterns': min(20 * scale, 64), 'channels': 8,
+                                      'songlen': min(40 * scale, 128)}),
+              'mmd0.med': (make_med, {'kind': 'MMD0', 'blocks': 6 * scale,
+                                      'songlen': min(12 * scale, 256)}),
+              'mmd1.med': (make_med, {'blocks': 6 * scale, 'songlen': min(12 * scale, 256)}),
+              'packed.xm': (make_xm, {'patterns': min(5 * scale, 256),
+                                      'songlen': min(10 * scale, 256)}),
+              'smf.mid': (make_mid, {'bars': 16 * scale}),
+              'project.rpp': (make_rpp, {'patterns': 6 * scale}),
+              'project.mmp': (make_mmp, {'patterns': 4 * scale}),
+              'project.mmpz': (make_mmp, {'patterns': 4 * scale, 'compress': True})}
+    result = []
+    for name, (maker, kwargs) in makers.items():
+        maker(destdir / name, **kwargs)
+        result.append(destdir / name)
+    return result
@@ -0,0 +1,142 @@
+"""ModReaderGui benchmarks - time the readers
+
+generates a set of files, runs the reader for each file through the same steps the batch
+program does and records how long every phase takes and how much memory it allocates
+(using the instrumentation in shared.py); the results are written as JSON so that a later
+run can be compared with them
+"""
+import sys
+import argparse
+import contextlib
+import dataclasses
+import datetime
+import json
+import pathlib
+import platform
+import tempfile
+import time
+from readerapp import shared, batch
+from benchmarks import generate
+
+
+def run_once(filename, template, destdir, trace_memory=False):
+    """read and transcribe a file once, recording the work done per reader method
+
+    drums are assigned like the batch program would, for file types that don't recognize
+    them by themselves the first two instruments are used as drums
+    returns the instrumentation report and the total time taken
+    """
+    ftype = batch.get_filetype(filename)
+    start = time.perf_counter()
+    with shared.instrumentation(trace_memory) as recorder:
+        loaded = batch.readers[ftype](str(filename))
+        nondrums, drums = loaded.get_instrument_lists()
+        mapping = {} if drums else dict(zip(nondrums[:2], 'bs'))
+        instruments, (samples, letters, printseq) = batch.assign_letters(nondrums, drums,
+                                                                         mapping)
+        options = dataclasses.replace(template, instruments=instruments, drumsamples=samples,
+                                      letters=letters, printseq=printseq,
+                                      names=shared.OutputNames(destdir, 'bench', ftype))
+        loaded.process(options)
+    return recorder.report(), time.perf_counter() - start
+
+
+def get_phases(report):
+    """add up the figures of a report per phase
+    """
+    phases = {}
+    for stats in report.values():
+        total = phases.setdefault(stats['phase'], {'calls': 0, 'seconds': 0.0,
+                                                   'cpu_seconds': 0.0, 'peak_bytes': 0})
+        total['calls'] += stats['calls']
+        total['seconds'] += stats['wall']
+        total['cpu_seconds'] += stats['cpu']
+        total['peak_bytes'] = max(total['peak_bytes'], stats['peak'] or 0)
+    return phases
+
+
+def bench_file(filename, template, repeat=5):
+    """return the results for one file
+
+    the times are the best of the given number of runs; the memory use is measured in a
+    separate run because tracing the allocations slows everything down
+    """
+    with tempfile.TemporaryDirectory() as destdir:
+        runs = [run_once(filename, template, destdir) for _ in range(repeat)]
+        traced = get_phases(run_once(filename, template, destdir, trace_memory=True)[0])
+    size = pathlib.Path(filename).stat().st_size
+    runs_phases = [get_phases(x) for x, _ in runs]
+    phases = {}
+    for name in [x for x, _ in shared.phase_prefixes]:
+        if name in runs_phases[0]:
+            phases[name] = {'calls': runs_phases[0][name]['calls'],
+                            'seconds': min(x[name]['seconds'] for x in runs_phases),
+                            'cpu_seconds': min(x[name]['cpu_seconds'] for x in runs_phases),
+                            'peak_bytes': traced[name]['peak_bytes']}
+    total = min(x for _, x in runs)
+    return {'size': size, 'phases': phases, 'total_seconds': total,
+            'bytes_per_second': size / total if total else 0}
+
+
+def compare(old, new, stream=sys.stdout):
+    """show the differences in time between two sets of results
+    """
+    for name, result in new['files'].items():
+        if name not in old['files']:
+            continue
+        before = old['files'][name]
+        print(f'{name}:', file=stream)
+        for phase, data in result['phases'].items():
+            if phase in before['phases']:
+                print(f"  {phase:8} {before['phases'][phase]['seconds'] * 1000:10.2f} ms"
+                      f" -> {data['seconds'] * 1000:10.2f} ms"
+                      f" ({data['seconds'] / before['phases'][phase]['seconds']:.2f}x)",
+                      file=stream)
+
+
+def parse_args(args=None):
+    """define and process command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Time the readers on generated files')
+    parser.add_argument('-s', '--scale', type=int, default=1,
+                        help='make the songs this many times longer (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of timed runs per file (default: %(default)s)')
+    parser.add_argument('-k', '--keep', metavar='DIR',
+                        help='generate the files in this directory and leave them there')
+    parser.add_argument('-f', '--full', action='store_true',
+                        help='show as continual timeline')
+    parser.add_argument('-n', '--max-events', type=int, default=32,
+                        help='break up timelines in max. this many events (default: %(default)s)')
+    parser.add_argument('-c', '--crop-empty', action='store_true', help='crop empty tracks')
+    parser.add_argument('-a', '--all-in-one', action='store_true', help='all in one file')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results to this file instead of standard output')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='show the changes in time compared to an earlier results file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    "main function"
+    args = parse_args(args)
+    template = shared.TranscriptionOptions(max_events=args.max_events, full=args.full,
+                                           crop_empty=args.crop_empty,
+                                           all_in_one=args.all_in_one)
+    with contextlib.ExitStack() as stack:
+        filesdir = args.keep or stack.enter_context(tempfile.TemporaryDirectory())
+        results = {'date': datetime.datetime.today().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'settings': vars(args),
+                   'files': {x.name: bench_file(x, template, args.repeat)
+                             for x in generate.generate(filesdir, args.scale)}}
+    if args.output:
+        with open(args.output, 'w') as _out:
+            json.dump(results, _out, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as _in:
+            compare(json.load(_in), results, sys.stderr if not args.output else sys.stdout)
+    return 0
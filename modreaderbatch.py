@@ -0,0 +1,7 @@
+#! /usr/bin/env python3
+"""ModreaderBatch startup script
+"""
+import sys
+from readerapp.batch import main
+if __name__ == '__main__':
+    sys.exit(main())
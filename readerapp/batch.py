@@ -0,0 +1,261 @@
+"""ModReaderGui - headless batch transcription
+
+transcribes all known files in a directory tree without starting the GUI,
+spreading the work over a pool of worker processes
+"""
+import sys
+import argparse
+import configparser
+import collections
+import concurrent.futures
+import multiprocessing
+import dataclasses
+import datetime
+import pathlib
+import time
+import importlib
+import contextlib
+import logging
+from readerapp import shared, cache
+
+
+class ReaderRegistry(collections.UserDict):
+    """the reader classes for the known file types, by file extension
+
+    maps the extension to the module and class name of the reader; the module is only
+    imported when a file of that type is loaded for the first time
+    """
+    def __getitem__(self, ftype):
+        reader = self.data[ftype]
+        if isinstance(reader, str):
+            modname, classname = reader.split(':')
+            reader = getattr(importlib.import_module(f'readerapp.{modname}'), classname)
+            self.data[ftype] = reader
+        return reader
+
+
+readers = ReaderRegistry({'mod': 'modreader:ModFile',
+                          'mid': 'midreader:MidiFile',
+                          'med': 'medreader:MedModule',
+                          'mmp': 'mmpreader:MMPFile',
+                          'mmpz': 'mmpreader:MMPFile',
+                          'rpp': 'rppreader:RppFile',
+                          'xm': 'xmreader:ExtModule'})
+
+
+def log(inp):
+    "local definition to allow for picking up module name in message format"
+    logging.info(inp)
+
+
+def get_filetype(filename):
+    """determine the file type from the file's extension
+    """
+    return pathlib.Path(filename).suffix[1:].lower()
+
+
+def load_file(filename, use_cache=True, progress=None):
+    """parse a file using the reader for its type
+
+    if the file was parsed before the result is taken from the cache
+    progress, if given, is called with a description of each step; the reader calls it for
+    each pattern or track it reads
+    returns the file type, the reader object and the lists of regular and drum instruments
+    """
+    ftype = get_filetype(filename)
+    reader = readers[ftype]
+    if use_cache:
+        if progress:
+            progress('looking in cache')
+        result = cache.get(filename, reader)
+        if result is not None:
+            return result
+    if progress:
+        progress(f'parsing {pathlib.Path(filename).name}')
+    loaded = reader(str(filename), progress=progress)
+    if progress:
+        progress('collecting instruments')
+    nondrums, drums = loaded.get_instrument_lists()
+    result = ftype, loaded, nondrums, drums
+    if use_cache:
+        if progress:
+            progress('storing in cache')
+        cache.put(filename, reader, result)
+    return result
+
+
+def assign_letters(nondrums, drums, mapping):
+    """divide the instruments into regular and drum instruments using a letter mapping
+
+    mapping associates instrument names with the letter(s) to print for them;
+    the sequence of the mapping determines the top-to-bottom sequence of the drums
+    returns the regular instruments and the drum samples, letters and print sequence
+    in the same form as the GUI's letter assignment
+    """
+    samples, letters = [], []
+    for item in drums:
+        name, letter = item.rsplit(' (', 1)
+        samples.append(name)
+        letters.append(mapping.get(name, letter[:-1]))
+    instruments = list(nondrums)
+    for name, letter in mapping.items():
+        if name in instruments:
+            instruments.remove(name)
+            samples.append(name)
+            letters.append(letter)
+    printseq = "".join([x for x in letters if len(x) == 1])
+    # letters only used in combinations get a dummy sample, like the GUI would ask for
+    missing = {x for x in ''.join(letters) if x not in printseq}
+    for letter in sorted(missing, key=lambda x: (x not in shared.standard_printseq,
+                                                 shared.standard_printseq.find(x), x)):
+        samples.append('dummy_sample')
+        letters.append(letter)
+        printseq += letter
+    return instruments, (samples, letters, printseq)
+
+
+def transcribe(filename, mapping, destdir, stamp, template, use_cache=True, profile=False):
+    """load a file and create the transcription files for it
+
+    template holds the transcription options that are the same for all files
+    with profile set the time spent in each step is recorded and returned as well
+    this is the unit of work for a worker process, so everything passed in
+    and returned has to be picklable
+    """
+    with contextlib.ExitStack() as stack:
+        recorder = stack.enter_context(shared.instrumentation()) if profile else None
+        ftype, loaded, nondrums, drums = load_file(filename, use_cache)
+        instruments, (samples, letters, printseq) = assign_letters(nondrums, drums, mapping)
+        pathlib.Path(destdir).mkdir(exist_ok=True, parents=True)
+        options = dataclasses.replace(template, instruments=instruments, drumsamples=samples,
+                                      letters=letters, printseq=printseq,
+                                      names=shared.OutputNames(destdir, stamp, ftype))
+        unlettered = loaded.process(options)
+    return str(filename), list(unlettered), recorder.report() if recorder else None
+
+
+def find_files(root):
+    """return all files of a known type in a directory tree
+    """
+    root = pathlib.Path(root)
+    if root.is_file():
+        return [root]
+    return sorted(x for x in root.rglob('*') if x.is_file() and get_filetype(x) in readers)
+
+
+def read_mapping(filename):
+    """read drum letter assignments from a config file
+
+    the [DEFAULT] section holds the mapping for all files, sections named after a file
+    (path relative to the root directory or just the file name) hold additions and
+    overrides for that file
+    """
+    mapping = configparser.ConfigParser(interpolation=None)
+    mapping.optionxform = lambda x: x
+    mapping.read(str(filename))
+    return mapping
+
+
+def get_mapping(filename, root, global_mapping, file_mapping):
+    """determine the drum letter mapping for a given file
+    """
+    result = dict(global_mapping)
+    if file_mapping is None:
+        return result
+    result.update(file_mapping.defaults())
+    relpath = filename.relative_to(root).as_posix() if root.is_dir() else filename.name
+    for section in (filename.name, relpath):
+        if file_mapping.has_section(section):
+            result.update({x: file_mapping[section][x] for x in file_mapping.options(section)})
+    return result
+
+
+def get_destination(filename, root, basedir):
+    """determine the output directory for a file, mirroring the GUI's default
+    """
+    relpath = filename.relative_to(root) if root.is_dir() else pathlib.Path(filename.name)
+    return basedir / relpath.parent / relpath.name.replace('_', ' ')
+
+
+def parse_args(args=None):
+    """define and process command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Transcribe all music files in a directory'
+                                     ' tree without using the GUI')
+    parser.add_argument('root', nargs='?', default=str(shared.location),
+                        help='file or directory to process (default: %(default)s)')
+    parser.add_argument('-o', '--dest', default=str(shared.basedir),
+                        help='directory to put the transcriptions in (default: %(default)s)')
+    parser.add_argument('-d', '--drums', action='append', default=[], metavar='NAME=LETTERS',
+                        help='assign letter(s) to a drum instrument for all files')
+    parser.add_argument('-m', '--mapping', metavar='FILE',
+                        help='config file with drum letter assignments per file')
+    parser.add_argument('-f', '--full', action='store_true',
+                        help='show as continual timeline')
+    parser.add_argument('-n', '--max-events', type=int, default=32,
+                        help='break up timelines in max. this many events (default: %(default)s)')
+    parser.add_argument('-c', '--crop-empty', action='store_true', help='crop empty tracks')
+    parser.add_argument('-a', '--all-in-one', action='store_true', help='all in one file')
+    parser.add_argument('--align', action='store_true',
+                        help='align drumtracks with instruments')
+    parser.add_argument('--atomic', action='store_true',
+                        help='write each file under a temporary name and rename it when done')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse all files again instead of using the cache')
+    parser.add_argument('--profile', action='store_true',
+                        help='show the time spent in each step of reading and transcribing')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    "main function"
+    args = parse_args(args)
+    logqueue = multiprocessing.Queue()
+    shared.setup_logging(logqueue)
+    root = pathlib.Path(args.root).expanduser()
+    basedir = pathlib.Path(args.dest).expanduser()
+    global_mapping = dict(x.split('=', 1) for x in args.drums)
+    file_mapping = read_mapping(args.mapping) if args.mapping else None
+    template = shared.TranscriptionOptions(max_events=args.max_events, full=args.full,
+                                           crop_empty=args.crop_empty,
+                                           all_in_one=args.all_in_one,
+                                           short_format=not args.align,
+                                           atomic_write=args.atomic)
+    stamp = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
+    files = find_files(root)
+
+    done, failed = 0, 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs,
+                                                initializer=shared.setup_worker_logging,
+                                                initargs=(logqueue,)) as executor:
+        futures = {executor.submit(transcribe, x, get_mapping(x, root, global_mapping,
+                                                              file_mapping),
+                                   get_destination(x, root, basedir), stamp, template,
+                                   not args.no_cache, args.profile): x
+                   for x in files}
+        reports = []
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                filename, unlettered, report = future.result()
+            except Exception as exc:    # one bad file should not stop the batch
+                failed += 1
+                log(f'{futures[future]}: {exc!r}')
+                print(f'{futures[future]}: failed ({exc})', file=sys.stderr)
+                continue
+            done += 1
+            if report:
+                reports.append(report)
+            for line in unlettered:
+                print(f'{filename}: {line}')
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed else 0
+    print(f'{done} files transcribed, {failed} failed in {elapsed:.2f} seconds'
+          f' ({rate:.1f} files per second)')
+    if reports:
+        print()
+        for line in shared.format_report(shared.merge_reports(reports)):
+            print(line)
+    return 1 if failed else 0
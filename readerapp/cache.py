@@ -0,0 +1,105 @@
+"""ModReaderGui - cache of parsed music files
+
+keeps what a reader has parsed from a file in a cache directory, so that opening a file that
+was loaded before doesn't have to parse it (or run an external program on it) again
+
+an entry is found by the file's path and holds the file's size, modification time and a hash
+of its contents; a file that was only touched (or copied back) is recognized by the hash
+the entries also record the version of the reader code, so they are ignored after an update
+"""
+import hashlib
+import inspect
+import logging
+import os
+import pathlib
+import pickle
+import threading
+from readerapp import shared
+
+CACHE_VERSION = 1
+
+
+def log(inp):
+    "local definition to allow for picking up module name in message format"
+    logging.info(inp)
+
+
+def get_digest(filename):
+    """return a hash of the contents of a file
+    """
+    return hashlib.blake2b(pathlib.Path(filename).read_bytes()).hexdigest()
+
+
+def get_code_stamp(reader):
+    """identify the version of the code that produced a cache entry
+    """
+    return (CACHE_VERSION, pathlib.Path(inspect.getfile(reader)).stat().st_mtime_ns,
+            pathlib.Path(shared.__file__).stat().st_mtime_ns)
+
+
+def get_cache_filename(filename):
+    """determine where the cache entry for a file is kept
+    """
+    path = str(pathlib.Path(filename).resolve())
+    return shared.cachedir / (hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+                              + '.pickle')
+
+
+def get(filename, reader):
+    """return what was stored for the file, or None if it isn't cached (anymore)
+
+    reader is the class used to parse the file
+    """
+    if shared.cachedir is None:
+        return None
+    cachefile = get_cache_filename(filename)
+    stat = os.stat(filename)
+    try:
+        with open(cachefile, 'rb') as _in:
+            header = pickle.load(_in)
+            if header['code'] != get_code_stamp(reader) or header['size'] != stat.st_size:
+                return None
+            if header['mtime'] != stat.st_mtime_ns and header['digest'] != get_digest(
+                    filename):
+                return None
+            return pickle.load(_in)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:    # a damaged entry just means parsing the file again
+        log(f'ignoring cache entry for {filename}: {exc!r}')
+        return None
+
+
+def put(filename, reader, data):
+    """store what was parsed from the file
+
+    reader is the class used to parse the file, data has to be picklable
+    """
+    if shared.cachedir is None:
+        return
+    stat = os.stat(filename)
+    header = {'code': get_code_stamp(reader), 'size': stat.st_size,
+              'mtime': stat.st_mtime_ns, 'digest': get_digest(filename)}
+    cachefile = get_cache_filename(filename)
+    temp = cachefile.with_name(f'.{cachefile.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        shared.cachedir.mkdir(parents=True, exist_ok=True)
+        with open(temp, 'wb') as _out:
+            pickle.dump(header, _out, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, _out, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cachefile)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError) as exc:
+        # not being able to cache shouldn't stop the loading
+        log(f'could not cache {filename}: {exc!r}')
+    finally:
+        if temp.exists():
+            temp.unlink()
+
+
+def clear():
+    """remove all cache entries
+    """
+    if shared.cachedir is None or not shared.cachedir.exists():
+        return
+    for entry in shared.cachedir.glob('*.pickle'):
+        entry.unlink()
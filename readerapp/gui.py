@@ -13,14 +13,18 @@ creates a collection of files containing:
 import sys
 import os
 import pathlib
+import collections
+import dataclasses
+import functools
 import datetime
 import logging
 import PyQt6.QtWidgets as qtw
 import PyQt6.QtGui as gui
 import PyQt6.QtCore as core
-from readerapp import shared, modreader, midreader, medreader, mmpreader, rppreader, xmreader
+from readerapp import shared, batch
 
 mru_filename = pathlib.Path(__file__).parent / 'mru_files'
+keep_loaded = 5     # number of parsed files kept in memory
 
 
 def log(inp):
@@ -28,14 +32,123 @@ def log(inp):
     logging.info(inp)
 
 
-def waiting_cursor(func):
-    "change the cursor before and after an operation"
-    def wrap_operation(self):
-        "the wrapped operation is a method without arguments"
-        self.app.setOverrideCursor(gui.QCursor(core.Qt.CursorShape.WaitCursor))
-        func(self)
-        self.app.restoreOverrideCursor()
-    return wrap_operation
+class Cancelled(Exception):
+    "raised in a background task when the user asked to stop it"
+
+
+class WorkerSignals(core.QObject):
+    """signals from a background task to the main screen
+
+    a QRunnable can't have signals of its own, so it uses an instance of this
+    """
+    progress = core.pyqtSignal(str)
+    finished = core.pyqtSignal(object)
+    failed = core.pyqtSignal(str)
+
+
+class Worker(core.QRunnable):
+    """run a function in a thread from the pool, reporting through signals
+
+    the function is called with a progress keyword argument: a callback taking a
+    description of the current step, that stops the function when the task is cancelled
+    """
+    def __init__(self, func, *args):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        """ask the task to stop at the next progress report
+        """
+        self.cancelled = True
+
+    def report(self, text):
+        """pass on progress, or stop if the task was cancelled
+        """
+        if self.cancelled:
+            raise Cancelled
+        self.signals.progress.emit(text)
+
+    def run(self):
+        """perform the task and signal the outcome
+        """
+        try:
+            result = self.func(*self.args, progress=self.report)
+        except Cancelled:
+            self.signals.failed.emit('Cancelled')
+        except Exception as exc:    # report the problem instead of losing the thread
+            log(f'background task failed: {exc!r}')
+            self.signals.failed.emit(str(exc))
+        else:
+            if self.cancelled:
+                self.signals.failed.emit('Cancelled')
+            else:
+                self.signals.finished.emit(result)
+
+
+class LoadedFiles:
+    """the most recently loaded files, so that loading one of them again is instant
+
+    holds the results of batch.load_file keyed on the file's path, size and modification
+    time, so a file that was changed since is parsed again
+    """
+    def __init__(self, maxsize=keep_loaded):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    @staticmethod
+    def get_key(filename):
+        """identify a file and its current version
+        """
+        path = pathlib.Path(filename).resolve()
+        stat = path.stat()
+        return str(path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, filename):
+        """return what was loaded from the file, or None if it isn't kept (anymore)
+        """
+        try:
+            key = self.get_key(filename)
+        except OSError:
+            return None
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def add(self, filename, result):
+        """keep what was loaded from a file, forgetting the least recently used ones
+        """
+        try:
+            key = self.get_key(filename)
+        except OSError:
+            return
+        self._items[key] = result
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+
+def transcribe(loaded, options, progress):
+    """create the transcription files for a loaded module, telling progress which file
+    is being written
+    """
+    return loaded.process(dataclasses.replace(options, progress=progress))
+
+
+def profiled(func, *args, progress):
+    """run a background task recording the time spent in the readers
+
+    returns the task's result and the report
+    """
+    with shared.instrumentation() as recorder:
+        result = func(*args, progress=progress)
+    return result, recorder.report()
 
 
 class GetDestDialog(qtw.QDialog):
@@ -94,6 +207,12 @@ class MainFrame(qtw.QWidget):
         self.drums = []
         self.nondrums = []
         self.filenaam = ''
+        self.worker = None
+        self.busy = False
+        self.threadpool = core.QThreadPool(self)
+        self.loaded_files = LoadedFiles()
+        self.preload_pool = core.QThreadPool(self)
+        self.preload_pool.setMaxThreadCount(1)
         self.title = "ModReaderGui"
         self.setWindowTitle(self.title)
         try:
@@ -106,6 +225,7 @@ class MainFrame(qtw.QWidget):
         self.create_widgets()
         self.create_actions()
         self.newdir = str(shared.basedir)
+        self.preload(reversed(self._mru_items[-keep_loaded:]))
 
     def create_widgets(self):
         """set up the GUI
@@ -120,6 +240,7 @@ class MainFrame(qtw.QWidget):
         self.ask_modfile.addItems(list(self._mru_items))
         self.ask_modfile.setEditText(self.filenaam)
         self.ask_modfile.editTextChanged.connect(self.namechange)
+        self.ask_modfile.textActivated.connect(lambda x: self.preload([x]))
         hbox.addWidget(self.ask_modfile)
         zoek_button = qtw.QPushButton("&Browse", self)
         zoek_button.clicked.connect(self.find_file)
@@ -129,9 +250,9 @@ class MainFrame(qtw.QWidget):
 
         hbox = qtw.QHBoxLayout()
         hbox.addStretch()
-        load_button = qtw.QPushButton("&Load module", self)
-        load_button.clicked.connect(self.load_module)
-        hbox.addWidget(load_button)
+        self.load_button = qtw.QPushButton("&Load module", self)
+        self.load_button.clicked.connect(self.load_module)
+        hbox.addWidget(self.load_button)
         hbox.addStretch()
         vbox.addLayout(hbox)
 
@@ -227,15 +348,21 @@ class MainFrame(qtw.QWidget):
         gbox.addWidget(self.check_nonempty, 0, 2)
         self.check_allinone = qtw.QCheckBox("All in one file", self)
         gbox.addWidget(self.check_allinone, 1, 2)
+        self.check_timings = qtw.QCheckBox("Show timings", self)
+        gbox.addWidget(self.check_timings, 2, 2)
         hbox.addLayout(gbox)
         hbox.addStretch()
         vbox.addLayout(hbox)
 
         hbox = qtw.QHBoxLayout()
         hbox.addStretch()
-        create_button = qtw.QPushButton("&Create transcription files", self)
-        create_button.clicked.connect(self.create_files)
-        hbox.addWidget(create_button)
+        self.create_button = qtw.QPushButton("&Create transcription files", self)
+        self.create_button.clicked.connect(self.create_files)
+        hbox.addWidget(self.create_button)
+        self.cancel_button = qtw.QPushButton("Ca&ncel", self)
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.setEnabled(False)
+        hbox.addWidget(self.cancel_button)
         # hbox.addStretch()
         # vbox.addLayout(hbox)
 
@@ -247,6 +374,11 @@ class MainFrame(qtw.QWidget):
         hbox.addStretch()
         vbox.addLayout(hbox)
 
+        hbox = qtw.QHBoxLayout()
+        self.status = qtw.QLabel('', self)
+        hbox.addWidget(self.status)
+        vbox.addLayout(hbox)
+
         self.setLayout(vbox)
         self.ask_modfile.setFocus()
 
@@ -313,10 +445,11 @@ class MainFrame(qtw.QWidget):
                     self._mru_items.pop(0)
                 self.ask_modfile.addItem(name)
 
-    @waiting_cursor
     def load_module(self):
-        """load and parse the chosen file and show detected instruments
+        """load and parse the chosen file in the background
         """
+        if self.busy:
+            return
         pad = self.ask_modfile.currentText()
         fn = pathlib.Path(pad)
         msg = ''
@@ -328,37 +461,32 @@ class MainFrame(qtw.QWidget):
             qtw.QMessageBox.information(self, self.title, msg)
             return
         ## self.ftype = os.path.splitext(pad)[1][1:].lower()
-        self.ftype = fn.suffix[1:].lower()
-        if self.ftype == 'mod':
-            self.loaded = modreader.ModFile(pad)
-            self.nondrums = [x[0] for x in self.loaded.samples.values() if x[0]]
-            self.drums = []
-        elif self.ftype == 'mid':
-            drumchnl = 10
-            self.loaded = midreader.MidiFile(pad)
-            self.nondrums = [x[0] for x in self.loaded.instruments.values() if x[1] != drumchnl]
-            self.drums = [x[0] + " (*)" for x in self.loaded.instruments.values() if x[1] == drumchnl]
-        elif self.ftype == 'med':
-            self.loaded = medreader.MedModule(pad)
-            self.nondrums = [x[1] for x in self.loaded.samplenames]
-            self.drums = []
-        elif self.ftype == 'mmpz':
-            self.loaded = mmpreader.MMPFile(pad)
-            self.nondrums = self.loaded.tracknames
-            if self.loaded.bbtracknames:
-                self.drums = [f'{x} ({x[0]})' for x in self.loaded.bbtracknames]
-            else:
-                self.drums = []
-        elif self.ftype == 'rpp':
-            self.loaded = rppreader.RppFile(pad)
-            self.nondrums = [y for x, y in self.loaded.instruments.items()
-                             if not self.loaded.patterns[x][0][1]['drumtrack']]
-            self.drums = [y + ' (*)' for x, y in self.loaded.instruments.items()
-                          if self.loaded.patterns[x][0][1]['drumtrack']]
-        elif self.ftype == 'xm':
-            self.loaded = xmreader.ExtModule(pad)
-            self.nondrums = [x[1] for x in self.loaded.samplenames]
-            self.drums = []
+        self.ftype = batch.get_filetype(fn)
+        if self.ftype not in batch.readers:
+            qtw.QMessageBox.information(self, self.title, 'Unknown file type')
+            return
+        result = self.loaded_files.get(pad)
+        if result:
+            self.show_loaded(pad, result)
+            return
+        self.start_task(batch.load_file, (pad,), functools.partial(self.show_loaded, pad))
+
+    def preload(self, filenames):
+        """parse files in the background, so that loading them later is instant
+        """
+        for name in filenames:
+            if (not pathlib.Path(name).is_file() or batch.get_filetype(name) not in batch.readers
+                    or name in self.loaded_files):
+                continue
+            worker = Worker(batch.load_file, name)
+            worker.signals.finished.connect(functools.partial(self.loaded_files.add, name))
+            self.preload_pool.start(worker)
+
+    def show_loaded(self, pad, result):
+        """show the instruments detected in the loaded file
+        """
+        self.loaded_files.add(pad, result)
+        self.ftype, self.loaded, self.nondrums, self.drums = result
         self.list_samples.clear()
         self.list_samples.addItems(self.nondrums)
         self.mark_samples.clear()
@@ -562,10 +690,72 @@ class MainFrame(qtw.QWidget):
         self.check_full.setFocus(True)
 
     def create_files(self):
-        """produce output and notify when ready
+        """produce output in the background
         """
         self.do_creation()
-        qtw.QMessageBox.information(self, self.title, 'Done')
+
+    def start_task(self, func, args, on_finished):
+        """run a function in the background, showing progress and enabling cancellation
+
+        on_finished is called with the function's result when it completes
+        if timings are asked for, the time spent in the reader is shown afterwards
+        """
+        if self.check_timings.isChecked():
+            args = (func,) + tuple(args)
+            func = profiled
+            on_finished = functools.partial(self.show_timings, on_finished)
+        self.load_button.setEnabled(False)
+        self.create_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.worker = Worker(func, *args)
+        self.worker.signals.progress.connect(self.status.setText)
+        self.worker.signals.finished.connect(functools.partial(self.task_done, on_finished))
+        self.worker.signals.failed.connect(self.task_failed)
+        self.busy = True
+        self.threadpool.start(self.worker)
+
+    def task_done(self, on_finished, result):
+        """reset the screen after a background task and handle its result
+        """
+        self.end_task()
+        on_finished(result)
+
+    def show_timings(self, on_finished, result):
+        """handle the result of a profiled task and show where the time went
+        """
+        result, report = result
+        on_finished(result)
+        if not report:
+            return
+        box = qtw.QMessageBox(self)
+        box.setWindowTitle(self.title)
+        box.setText(f"Time spent in the reader: {sum(x['wall'] for x in report.values()):.3f}"
+                    " seconds")
+        box.setDetailedText('\n'.join(shared.format_report(report)))
+        box.setFont(gui.QFontDatabase.systemFont(gui.QFontDatabase.SystemFont.FixedFont))
+        box.exec()
+
+    def end_task(self):
+        """reset the screen after a background task
+        """
+        self.busy = False
+        self.status.setText('')
+        self.load_button.setEnabled(True)
+        self.create_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def task_failed(self, msg):
+        """report a background task that didn't complete
+        """
+        self.end_task()
+        qtw.QMessageBox.information(self, self.title, msg)
+
+    def cancel(self):
+        """stop the running background task
+        """
+        if self.busy:
+            self.status.setText('cancelling...')
+            self.worker.cancel()
 
     def help(self):
         """show some help info
@@ -575,6 +765,11 @@ class MainFrame(qtw.QWidget):
     def exit(self):
         """close the application
         """
+        if self.busy:
+            self.worker.cancel()
+        self.preload_pool.clear()
+        self.threadpool.waitForDone()
+        self.preload_pool.waitForDone()
         mru_filename.write_text('\n'.join(self._mru_items) + '\n')
         self.close()
 
@@ -622,20 +817,17 @@ class MainFrame(qtw.QWidget):
         self.assigned = samples, letters, printseq
         return msg
 
-    def get_general_filename(self):
-        """determine filename for overview file
+    def get_options(self):
+        """collect the transcription settings from the screen
         """
-        return self.get_instrument_filename('general')
-
-    def get_drums_filename(self):
-        """determine filename for drum instrument file
-        """
-        return self.get_instrument_filename('drums')
-
-    def get_instrument_filename(self, name):
-        """determine filename for "regular" instrument file
-        """
-        return str(pathlib.Path(self.newdir) / f'{self.dts}-{self.ftype}-{name}')
+        samples, letters, printseq = self.assigned
+        return shared.TranscriptionOptions(
+            instruments=self.list_items(self.list_samples), drumsamples=samples,
+            letters=letters, printseq=printseq, max_events=self.max_events.value(),
+            full=self.check_full.isChecked(), crop_empty=self.check_nonempty.isChecked(),
+            all_in_one=self.check_allinone.isChecked(),
+            short_format=not self.check_align.isChecked(),
+            names=shared.OutputNames(self.newdir, self.dts, self.ftype))
 
     @staticmethod
     def list_items(listbox):
@@ -923,10 +1115,11 @@ class MainFrame(qtw.QWidget):
     #             else:
     #                 self.loaded.print_instrument(number, out)
 
-    @waiting_cursor
     def do_creation(self):
-        """create output file(s)
+        """create output file(s) in the background
         """
+        if self.busy:
+            return
         msg = ''
         if not self.loaded:
             msg = 'Please load a module first'
@@ -939,8 +1132,6 @@ class MainFrame(qtw.QWidget):
         pathlib.Path(self.newdir).mkdir(exist_ok=True, parents=True)
         self.dts = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
 
-        self.loaded.short_format = not self.check_align.isChecked()
-        self.loaded.show_continual = self.check_full.isChecked()
         # go_dict = {'mod': self.process_modfile,
         #            'mid': self.process_midifile,
         #            'xm': self.process_xmfile,
@@ -949,13 +1140,19 @@ class MainFrame(qtw.QWidget):
         #            'mmpz': self.process_mmpfile,
         #            'rpp': self.process_rppfile}
         # go_dict[self.ftype]()
-        unlettered = self.loaded.process(self)
+        self.start_task(transcribe, (self.loaded, self.get_options()), self.show_created)
+
+    def show_created(self, unlettered):
+        """notify that the transcription is ready
+        """
         if unlettered:
             qtw.QMessageBox.information(self, self.title, '\n'.join(unlettered))
+        qtw.QMessageBox.information(self, self.title, 'Done')
 
 
 def main():
     "main function"
+    shared.setup_logging()
     app = qtw.QApplication(sys.argv)
     MainFrame(app)
     sys.exit(app.exec())
@@ -3,6 +3,7 @@
 import sys
 import struct
 import collections
+import functools
 import logging
 from readerapp import shared
 
@@ -22,56 +23,53 @@ def get_note_name(inp):
     return shared.get_note_name(inp + 3 * shared.octave_length)
 
 
-def mmd0_decode(data):
-    """return data read from file (short - MMD0 - format) as note event information
-    """
-    note_number = data[0] & 0x3F
-    instr_hi = (data[0] & 0xC0) >> 2
-    instr_lo = data[1] >> 4
-    instr_number = instr_hi + instr_lo
-    command = data[1] & 0x0F
-    return note_number, instr_number, command, data[2]
-
+def mmd0_decode(data, tracks):
+    """return block data read from file (short - MMD0 - format) as note event information
 
-def mmd1_decode(data):
-    """return data read from file (long - MMD1 - format) as note event information
+    the result is a list of lines, each line containing a (note number, instrument number)
+    pair for each track
     """
-    note_number = data[0] & 0x7F
-    instr_number = data[1] & 0x3F
-    return note_number, instr_number, data[2], data[3]
+    events = [(byte0 & 0x3F, ((byte0 & 0xC0) >> 2) + (byte1 >> 4))
+              for byte0, byte1, _ in struct.iter_unpack('3B', data)]
+    return [events[ix:ix + tracks] for ix in range(0, len(events), tracks)]
 
 
-def read_pointer(stream):
-    """read data from the file that is used as a pointer
+def mmd1_decode(data, tracks):
+    """return block data read from file (long - MMD1 - format) as note event information
+
+    the result is a list of lines, each line containing a (note number, instrument number)
+    pair for each track
     """
-    return struct.unpack('>L', stream.read(4))[0]
+    events = [(byte0 & 0x7F, byte1 & 0x3F) for byte0, byte1, _, _ in struct.iter_unpack('4B', data)]
+    return [events[ix:ix + tracks] for ix in range(0, len(events), tracks)]
 
 
-def read_string(stream, length):
-    """read data from the file and return as a text string
+def get_string(data):
+    """return data read from file as a text string
     """
-    text = struct.unpack(f'{length}s', stream.read(length))
     try:
-        result = str(text[0], encoding='utf-8')
+        result = str(data, encoding='utf-8')
     except UnicodeDecodeError:
-        result = str(text[0], encoding='latin-1')
+        result = str(data, encoding='latin-1')
     return result.rstrip('\x00')
 
 
-class MedModule:
+class MedModule(shared.TrackerModule):
     """Main processing class
+
+    progress, if given, is called for each block read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.pattern_data = {}
         self.pattern_lengths = []
         self.short_format = None
         self.show_continual = None
-        self.read()
+        self.read(progress)
         if not self._pattern_data:
             raise ValueError('Empty module !?')
-        self._all_events = collections.defaultdict(lambda: collections.defaultdict(
-            lambda: collections.defaultdict(list)))
+        self._all_events = collections.defaultdict(functools.partial(
+            collections.defaultdict, functools.partial(collections.defaultdict, list)))
         sampledata_found = collections.defaultdict(lambda: False)
         for pattnum, pattern in enumerate(self._pattern_data):
             length, pattern = pattern
@@ -88,129 +86,114 @@ class MedModule:
                 samples_to_keep.append((ix, samp))
         self.samplenames = samples_to_keep
 
-    def read(self):
+    @shared.instrumented
+    def read(self, progress=None):
         """read the file via structures into an internal data collection
 
-        instead of repositioning while reading, why not read the entire file first
-        and then (re)position in memory?
+        the entire file is read first, the parts are then taken from memory
+        progress, if given, is called with a description of each block before reading it;
+        it can stop the reading by raising an exception
         """
         with open(self.filename, 'rb') as _med:
-
-            mod_header = struct.unpack('>4s9L4HhBB', _med.read(52))
-            self.modtype = str(mod_header[0], encoding='utf-8')
-            if self.modtype not in ('MMD0', 'MMD1'):
-                raise ValueError('Not a valid MED module')
-            ## modlen = mod_header[1]
-            songinfo_start = mod_header[2]
-            blockarray_start = mod_header[4]
-            instheader_start = mod_header[6]
-            expansion_start = mod_header[8]
-
-            _med.seek(songinfo_start)
-            songinfo = struct.unpack('>504BHH256BHBbbb16bbb', _med.read(788))
-            blockcount = songinfo[504]
-            self.songlen = songinfo[505]
-            self.raw_playseq = songinfo[506:506 + 256]
-            self.sample_count = songinfo[784]
-
-            _med.seek(blockarray_start)
-            blockstart_list = []
-            for i in range(blockcount):
-                blockstart_list.append(read_pointer(_med))
-
-            _med.seek(instheader_start)
-            samplestart_list = []
-            for i in range(self.sample_count):
-                samplestart_list.append(read_pointer(_med))
-
-            _med.seek(expansion_start)
-            data = struct.unpack('>LLHHLLLHH7L7B', _med.read(63))
-            ## instrext_start, instrext_count, instrext_len = data[1:4]
-            songoms_start, songoms_len = data[4:6]
-            instrinfo_start, instrinfo_count, instrinfo_len = data[6:9]
-
-            _med.seek(songoms_start)
-            self.songdesc = read_string(_med, songoms_len)
-
-            compare = instrinfo_count == self.sample_count
-            _med.seek(instrinfo_start)
-            self.samplenames = []
-            for i in range(instrinfo_count):
-                instname = read_string(_med, instrinfo_len)
-                if compare and samplestart_list[i] == 0:
-                    instname += ' (unnamed)'
-                self.samplenames.append(instname)
-
-            pattern_lengths_and_data = []
-            self._pattern_data = []
-            self.pattern_desc = {}
-            for address in blockstart_list:
-                _med.seek(address)
-                this_pattern = []
-                if self.modtype == 'MMD0':
-                    tracks, lines = struct.unpack('BB', _med.read(2))
-                    this_pattern.append(lines)
-                    for i in range(lines + 1):
-                        linedata = []
-                        for j in range(tracks):
-                            notedata = struct.unpack('3B', _med.read(3))
-                            linedata.append(mmd0_decode(notedata)[:2])
-                        this_pattern.append(linedata)
-
-                elif self.modtype == 'MMD1':
-                    tracks, lines, address = struct.unpack('>HHL', _med.read(8))
-                    for x in range(lines + 1):
-                        linedata = []
-                        for y in range(tracks):
-                            notedata = struct.unpack('4B', _med.read(4))
-                            linedata.append(mmd1_decode(notedata)[:2])
-                        this_pattern.append(linedata)
-
-                    if address:
-                        _med.seek(address)
-                        data = struct.unpack('>3L', _med.read(12))
-                        address, length = data[1:]
-                        _med.seek(address)
-                        pattern_text = read_string(_med, length)
-                        self.pattern_desc[i] = pattern_text
-
-                pattern_lengths_and_data.append((lines + 1, this_pattern))
-
-            # now to split up the patterns to be no longer that 32
-            new_patterns = []
-            all_patt_lengths = collections.defaultdict(list)
-            newpattnums = collections.defaultdict(list)
-            pattnum = 0
-            for ix, pattdata in enumerate(pattern_lengths_and_data):
-                pattlen, patt = pattdata
-                while pattlen > shared.per_line:
-                    old_pattlen = shared.per_line
-                    old_patt = patt[:old_pattlen]
-                    new_patterns.append((old_pattlen, old_patt))
-                    pattlen -= old_pattlen
-                    patt = patt[old_pattlen:]
-                    all_patt_lengths[ix].append(old_pattlen)
-                    newpattnums[ix].append(pattnum)
-                    pattnum += 1
-                new_patterns.append((pattlen, patt))
-                all_patt_lengths[ix].append(pattlen)
+            filedata = memoryview(_med.read())
+
+        mod_header = struct.unpack_from('>4s9L4HhBB', filedata)
+        self.modtype = str(mod_header[0], encoding='utf-8')
+        if self.modtype not in ('MMD0', 'MMD1'):
+            raise ValueError('Not a valid MED module')
+        ## modlen = mod_header[1]
+        songinfo_start = mod_header[2]
+        blockarray_start = mod_header[4]
+        instheader_start = mod_header[6]
+        expansion_start = mod_header[8]
+
+        songinfo = struct.unpack_from('>504BHH256BHBbbb16bbb', filedata, songinfo_start)
+        blockcount = songinfo[504]
+        self.songlen = songinfo[505]
+        self.raw_playseq = songinfo[506:506 + 256]
+        self.sample_count = songinfo[784]
+
+        blockstart_list = struct.unpack_from(f'>{blockcount}L', filedata, blockarray_start)
+        samplestart_list = struct.unpack_from(f'>{self.sample_count}L', filedata,
+                                              instheader_start)
+
+        data = struct.unpack_from('>LLHHLLLHH7L7B', filedata, expansion_start)
+        ## instrext_start, instrext_count, instrext_len = data[1:4]
+        songoms_start, songoms_len = data[4:6]
+        instrinfo_start, instrinfo_count, instrinfo_len = data[6:9]
+
+        self.songdesc = get_string(filedata[songoms_start:songoms_start + songoms_len])
+
+        compare = instrinfo_count == self.sample_count
+        self.samplenames = []
+        for i in range(instrinfo_count):
+            address = instrinfo_start + i * instrinfo_len
+            instname = get_string(filedata[address:address + instrinfo_len])
+            if compare and samplestart_list[i] == 0:
+                instname += ' (unnamed)'
+            self.samplenames.append(instname)
+
+        pattern_lengths_and_data = []
+        self._pattern_data = []
+        self.pattern_desc = {}
+        for blocknum, address in enumerate(blockstart_list):
+            if progress:
+                progress(f'reading block {blocknum + 1} of {blockcount}')
+            if self.modtype == 'MMD0':
+                tracks, lines = struct.unpack_from('BB', filedata, address)
+                start = address + 2
+                this_pattern = mmd0_decode(filedata[start:start + (lines + 1) * tracks * 3],
+                                           tracks)
+
+            elif self.modtype == 'MMD1':
+                tracks, lines, address = struct.unpack_from('>HHL', filedata, address)
+                start = blockstart_list[blocknum] + 8
+                this_pattern = mmd1_decode(filedata[start:start + (lines + 1) * tracks * 4],
+                                           tracks)
+
+                if address:
+                    address, length = struct.unpack_from('>3L', filedata, address)[1:]
+                    self.pattern_desc[blocknum] = get_string(filedata[address:address + length])
+
+            pattern_lengths_and_data.append((lines + 1, this_pattern))
+
+        # now to split up the patterns to be no longer that 32
+        new_patterns = []
+        all_patt_lengths = collections.defaultdict(list)
+        newpattnums = collections.defaultdict(list)
+        pattnum = 0
+        for ix, pattdata in enumerate(pattern_lengths_and_data):
+            pattlen, patt = pattdata
+            while pattlen > shared.per_line:
+                old_pattlen = shared.per_line
+                old_patt = patt[:old_pattlen]
+                new_patterns.append((old_pattlen, old_patt))
+                pattlen -= old_pattlen
+                patt = patt[old_pattlen:]
+                all_patt_lengths[ix].append(old_pattlen)
                 newpattnums[ix].append(pattnum)
                 pattnum += 1
+            new_patterns.append((pattlen, patt))
+            all_patt_lengths[ix].append(pattlen)
+            newpattnums[ix].append(pattnum)
+            pattnum += 1
         self._pattern_data = new_patterns
         self.pattern_count = blockcount
-        self.playseq, self.all_pattern_lengths = [], []
+        self.playseq, self.play_lengths = [], []
         for patt in self.raw_playseq[:self.songlen]:
             self.playseq.extend(newpattnums[patt])
-            self.all_pattern_lengths.extend(all_patt_lengths[patt])
-        self.all_pattern_lengths = self.all_pattern_lengths[:self.songlen]
+            self.play_lengths.extend(all_patt_lengths[patt])
+        self.play_lengths = self.play_lengths[:self.songlen]
 
-    def process(self, gui):
+    def process(self, options):
         """Create output for (Octa)Med module
         """
+        self.short_format = options.short_format
+        self.show_continual = options.full
         drums = []
         nondrums = []
-        samples, letters, printseq = gui.assigned
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
+        samples, letters, printseq = options.drumsamples, options.letters, options.printseq
+        opts = (options.max_events, options.crop_empty)
 
         for num, name in enumerate(self.samplenames):
             name = name[1]
@@ -218,36 +201,36 @@ class MedModule:
                 ix = samples.index(name)
                 drums.append((num + 1, letters[ix]))
 
-        for name in gui.list_items(gui.list_samples):
+        for name in options.instruments:
             ix = [y for x, y in self.samplenames].index(name)
             nondrums.append((ix + 1, name))
 
-        with open(gui.get_general_filename(), "w") as out:
+        with options.open_output(options.names.get_general_filename(), 'w') as out:
             if drums:
-                log(f'calling print_general_data with args {drums} {gui.show_continual} {out}')
-                self.print_general_data(drums, gui.show_continual, out)
+                log(f'calling print_general_data with args {drums} {self.show_continual} {out}')
+                self.print_general_data(drums, self.show_continual, out)
             else:
-                log(f'calling print_general_data with args {gui.show_continual} {out}')
-                self.print_general_data(full=gui.show_continual, _out=out)
+                log(f'calling print_general_data with args {self.show_continual} {out}')
+                self.print_general_data(full=self.show_continual, _out=out)
         log(f'calling prepare_print_instruments with argument {nondrums}')
         self.prepare_print_instruments(nondrums)
         self.prepare_print_drums(printseq)
-        if gui.check_allinone.isChecked():
-            with open(gui.get_general_filename(), 'a') as _out:
-                self.print_all_instruments_full(nondrums, printseq, options, _out)
+        if options.all_in_one:
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
+                self.print_all_instruments_full(nondrums, printseq, opts, _out)
             return []
         if drums:
-            with open(gui.get_drums_filename(), "w") as out:
-                if gui.check_full.isChecked():
-                    ## self.print_drums_full(drums, printseq, options, out)
-                    self.print_drums_full(printseq, options, out)
+            with options.open_output(options.names.get_drums_filename(), 'w') as out:
+                if options.full:
+                    ## self.print_drums_full(drums, printseq, opts, out)
+                    self.print_drums_full(printseq, opts, out)
                 else:
                     ## self.print_drums(drums, printseq, out)
                     self.print_drums(printseq, out)
         for number, name in nondrums:
-            with open(gui.get_instrument_filename(name), "w") as out:
-                if gui.check_full.isChecked():
-                    self.print_instrument_full(name, options, out)
+            with options.open_output(options.names.get_instrument_filename(name), 'w') as out:
+                if options.full:
+                    self.print_instrument_full(number, opts, out)
                 else:
                     log(f'calling print_instrument with args {number} {out}')
                     self.print_instrument(number, out)
@@ -262,92 +245,26 @@ class MedModule:
                 f'number of patterns = {self.pattern_count}, len of pattern data list ='
                 f' {len(self.pattern_data)}')
 
+    @shared.instrumented
     def remove_duplicate_patterns(self, sampnum):
         """show patterns only once for incontiguous timelines
         """
-        renumber = {}
-        pattern_list = []
         newsampnum = self.samplenames[sampnum][0] + 1
-        for pattnum, data in self._all_events.items():
-            for sampno, patt in data.items():
-                if sampno != newsampnum:
-                    continue
-                try:
-                    new_pattnum = pattern_list.index(patt) + 1
-                except ValueError:
-                    pattern_list.append(patt)
-                    new_pattnum = len(pattern_list)
-                renumber[pattnum] = new_pattnum
-        self.pattern_data[sampnum + 1] = pattern_list
-        for ix, seq in enumerate(self.playseq):
-            if ix >= self.songlen:
-                break
-            if seq in renumber:
-                self.playseqs[sampnum + 1].append(renumber[seq])
-            else:
-                self.playseqs[sampnum + 1].append(-1)
+        self.renumber_patterns(sampnum + 1, ((pattnum, data[newsampnum])
+                                             for pattnum, data in self._all_events.items()
+                                             if newsampnum in data),
+                               self.playseq[:self.songlen])
 
+    @shared.instrumented
     def remove_duplicate_drum_patterns(self, samplist):
         """show patterns only once for incontiguous timelines
         """
         inst2samp = {x: y[0] + 1 for x, y in enumerate(self.samplenames)}
-        ## samp2inst = {y[0] + 1: x for x, y in enumerate(self.samplenames)}
-        single_instrument_samples = [inst2samp[x - 1] for x, y in samplist
-                                     if len(y) == 1]
-        ## lookup = {y: inst2samp[x - 1] for x, y in samplist if len(y) == 1}
         samp2lett = {inst2samp[x - 1]: y for x, y in samplist}
-        drumpatterns = collections.defaultdict(lambda: collections.defaultdict(list))
-        self.pattlengths = collections.defaultdict(dict)
-
-        for pattnum, data in self._all_events.items():
-            for sampnum, patt in data.items():
-                if sampnum not in single_instrument_samples:
-                    continue
-                samplett = samp2lett[sampnum]
-                drumpatterns[pattnum]['len'].append((samplett, patt['len']))
-                # theoretisch kan dit data voor meer toonhoogten bevatten
-                # maar voor mijn spullen kan ik uitgaan van één
-                drumpatterns[pattnum][samplett] = [y for x, y in patt.items()
-                                                   if x != 'len'][0]
-        for pattnum, data in self._all_events.items():
-            for sampnum, patt in data.items():
-                if sampnum in single_instrument_samples:
-                    continue
-                try:
-                    instletters = samp2lett[sampnum]
-                except KeyError:
-                    continue
-
-                for letter in instletters:
-                    drumpatterns[pattnum]['len'].append((letter, patt['len']))
-                    # theoretisch kan dit data voor meer toonhoogten bevatten
-                    # maar voor mijn spullen kan ik uitgaan van één
-                    drumpatterns[pattnum][letter].extend([y for x, y in patt.items()
-                                                          if x != 'len'][0])
-                    drumpatterns[pattnum][letter].sort()
-        renumber = {}
-        pattern_list = []
-        for pattnum, patt in drumpatterns.items():
-            lengths = [x[1] for x in patt['len']]
-            if max(lengths) != lengths[0] or min(lengths) != lengths[0]:
-                print(f'ongelijke lengtes in pattern {pattnum}: {lengths}')
-            patt['len'] = lengths[0]
-
-            try:
-                new_pattnum = pattern_list.index(patt) + 1
-            except ValueError:
-                pattern_list.append(patt)
-                new_pattnum = len(pattern_list)
-            renumber[pattnum] = new_pattnum
-        self.pattern_data['drums'] = pattern_list
-        for ix, seq in enumerate(self.playseq):
-            if ix >= self.songlen:
-                break
-            if seq in renumber:
-                self.playseqs['drums'].append(renumber[seq])
-            else:
-                self.playseqs['drums'].append(-1)
+        drumpatterns = self.merge_drum_patterns(self._all_events, samp2lett)
+        self.renumber_patterns('drums', drumpatterns.items(), self.playseq[:self.songlen])
 
+    @shared.instrumented
     def print_general_data(self, sample_list=None, full=False, _out=sys.stdout):
         """create the "overview" file (sample and pattern lists)
         """
@@ -386,6 +303,7 @@ class MedModule:
         for text in data:
             print(text.rstrip(), file=_out)
 
+    @shared.instrumented
     def print_drums(self, printseq, _out=sys.stdout):
         """collect the drum sample events and print them together
 
@@ -408,6 +326,7 @@ class MedModule:
                         print('', file=_out)
             print('', file=_out)
 
+    @shared.instrumented
     def print_instrument(self, sample, _out=sys.stdout):
         """print the events for an instrument as a piano roll
 
@@ -432,157 +351,7 @@ class MedModule:
                     print(' '.join(printable), file=_out)
             print('', file=_out)
 
-    def prepare_print_drums(self, printseq):
-        """build complete timeline for drum instrument events
-        """
-        self.all_drum_tracks = collections.defaultdict(list)
-        for pattseq, pattnum in enumerate(self.playseqs['drums']):
-            if pattnum == -1:
-                pattlen = self.all_pattern_lengths[pattseq]
-                for inst in printseq:
-                    self.all_drum_tracks[inst].extend([shared.empty_drums] * pattlen)
-                continue
-            pattern = self.pattern_data['drums'][pattnum - 1]
-
-            for inst in printseq:
-                events = list(pattern[inst])
-                for i in range(pattern['len']):
-                    to_append = inst if i in events else shared.empty_drums
-                    self.all_drum_tracks[inst].append(to_append)
-
-    def print_drums_full(self, printseq, opts, _out=sys.stdout):
-        """output the drums timeline to a separate file/stream
-
-        printseq indicates the top-to-bottom sequence of instruments
-        opts indicates how many events per line and whether to print "empty" lines
+    def get_note_label(self, note):
+        """return the text to show for a note in the timelines
         """
-        interval, clear_empty = opts
-        sep = shared.sep_long
-        if self.short_format:
-            interval *= 2
-            sep = ''
-        empty = sep.join(interval * [shared.empty_drums])
-        total_length = sum(self.all_pattern_lengths)
-        for eventindex in range(0, total_length, interval):
-            if eventindex + interval > total_length:
-                empty = sep.join((total_length - eventindex) * [shared.empty_drums])
-            not_printed = True
-            for inst in printseq:
-                line = sep.join(self.all_drum_tracks[inst][eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_drums, file=_out)
-            print('', file=_out)
-
-    def prepare_print_instruments(self, instlist):
-        """build complete timeline for all regular instrument events
-        """
-        self.all_note_tracks = collections.defaultdict(
-            lambda: collections.defaultdict(list))
-        self.all_notes = collections.defaultdict(set)
-
-        for sampnum, sample in instlist:
-
-            for pattern in self.pattern_data[sampnum]:
-                self.all_notes[sample].update(pattern.keys())
-            self.all_notes[sample].discard('len')
-            self.all_notes[sample] = list(reversed(sorted(self.all_notes[sample])))
-
-            for pattseq, pattnum in enumerate(self.playseqs[sampnum]):
-                if pattnum == -1:
-                    pattlen = self.all_pattern_lengths[pattseq]
-                    for note in self.all_notes[sample]:
-                        self.all_note_tracks[sample][note].extend(
-                            [shared.empty_note] * pattlen)
-                    continue
-                pattern = self.pattern_data[sampnum][pattnum - 1]
-                for note in self.all_notes[sample]:
-                    events = pattern[note]
-                    for i in range(pattern['len']):
-                        if i in events:
-                            to_append = shared.get_note_name(
-                                note + 3 * shared.octave_length - 1)
-                        else:
-                            to_append = shared.empty_note
-                        self.all_note_tracks[sample][note].append(to_append)
-
-    def print_instrument_full(self, sample, opts, _out=sys.stdout):
-        """output an instrument timeline to a separate file/stream
-
-        sample indicates the instrument to process
-        opts indicates how many events per line and whether to print "empty" lines
-        """
-        interval, clear_empty = opts
-        sep = ' '
-        empty = sep.join(interval * [shared.empty_note])
-        total_length = sum(self.all_pattern_lengths)
-        for eventindex in range(0, total_length, interval):
-            if eventindex + interval > total_length:
-                empty = sep.join(
-                    (total_length - eventindex) * [shared.empty_note])
-            not_printed = True
-            for note in self.all_notes[sample]:
-                events = self.all_note_tracks[sample][note]
-                line = sep.join(events[eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_note, file=_out)
-            print('', file=_out)
-
-    def print_all_instruments_full(self, instlist, printseq, opts, _out=sys.stdout):
-        """output all instrument timelines to the "general" file
-
-        instlist indicates the top-to-bottom sequence of instruments
-        printseq indicates the top-to-bottom sequence of drum instruments
-        opts indicates how many events per line and whether to print "empty" lines
-        """
-        interval, clear_empty = opts
-        total_length = sum(self.all_pattern_lengths)
-
-        for eventindex in range(0, total_length, interval):
-
-            sep = ' '
-            empty = sep.join(interval * [shared.empty_note])
-            if eventindex + interval > total_length:
-                empty = sep.join((total_length - eventindex) * [shared.empty_note])
-            for _, sample in instlist:
-                print(f'{sample}:', file=_out)
-                not_printed = True
-                for note in self.all_notes[sample]:
-                    notes = self.all_note_tracks[sample][note]
-                    line = sep.join(notes[eventindex:eventindex + interval])
-                    if clear_empty and (line == empty or not line):
-                        pass
-                    else:
-                        print('  ', line, file=_out)
-                        not_printed = False
-                if not_printed:
-                    print('  ', shared.empty_note, file=_out)
-                print('', file=_out)
-
-            sep = '' if self.short_format else shared.sep_long
-            empty = sep.join(interval * [shared.empty_drums])
-            if eventindex + interval > total_length:
-                empty = sep.join((total_length - eventindex) * [shared.empty_drums])
-            print('drums:', file=_out)
-            not_printed = True
-            for inst in printseq:
-                line = sep.join(self.all_drum_tracks[inst][eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print('  ', line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print('  ', shared.empty_drums, file=_out)
-            print('', file=_out)
-
-            print('', file=_out)
+        return shared.get_note_name(note + 3 * shared.octave_length - 1)
@@ -2,7 +2,8 @@
 """
 import sys
 ## import os
-import pathlib
+import shutil
+import struct
 import subprocess
 import csv
 import collections
@@ -15,10 +16,94 @@ def log(inp):
     logging.info(inp)
 
 
+def get_varlen(data, pos):
+    """read a variable length quantity from the data
+
+    returns the value and the position after it
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_smf(data, progress=None):
+    """interpret the contents of a standard midi file
+
+    yields the events that are needed to build the internal data collection, in the same
+    form as midicsv would produce them: track number (0 for the header), absolute time in
+    ticks, event name and event data
+    progress, if given, is called with a description of each track before reading it
+    """
+    if data[:4] != b'MThd':
+        raise ValueError('Not a valid MIDI file')
+    header_size, midi_format, track_count, division = struct.unpack_from('>LHHH', data, 4)
+    yield 0, 0, 'Header', [midi_format, track_count, division]
+    pos = 8 + header_size
+    track = 0
+    while pos + 8 <= len(data):
+        chunk_type = bytes(data[pos:pos + 4])
+        end = pos + 8 + struct.unpack_from('>L', data, pos + 4)[0]
+        pos += 8
+        if chunk_type != b'MTrk':
+            pos = end
+            continue
+        track += 1
+        if progress:
+            progress(f'reading track {track} of {track_count}')
+        tick = 0
+        running_status = 0
+        while pos < end:
+            delta, pos = get_varlen(data, pos)
+            tick += delta
+            status = data[pos]
+            if status & 0x80:
+                pos += 1
+                if status < 0xF0:
+                    running_status = status
+            else:       # running status: this is already the first data byte
+                status = running_status
+            if status == 0xFF:
+                meta_type = data[pos]
+                length, pos = get_varlen(data, pos + 1)
+                if meta_type == 0x03:   # sequence/track name
+                    yield track, tick, 'Title_t', [str(data[pos:pos + length],
+                                                       encoding='latin-1')]
+                pos += length
+                if meta_type == 0x2F:   # end of track
+                    break
+            elif status in (0xF0, 0xF7):
+                length, pos = get_varlen(data, pos)
+                pos += length
+            elif status & 0xF0 in (0xC0, 0xD0):
+                pos += 1
+            elif 0x80 <= status < 0xF0:
+                if status & 0xF0 == 0x90:
+                    yield track, tick, 'Note_on_c', [status & 0x0F, data[pos], data[pos + 1]]
+                pos += 2
+            else:
+                raise ValueError(f'Unexpected status byte in track {track} at time {tick}')
+        pos = end
+
+
+def read_midicsv(filename):
+    """convert the midi file into csv using midicsv and return the lines
+    """
+    result = subprocess.run(['midicsv', filename], capture_output=True, check=True,
+                            encoding='latin-1')
+    for track, tick, event, *data in csv.reader(result.stdout.splitlines()):
+        yield int(track), int(tick), event.strip(), data
+
+
 class MidiFile:
     """Main processing class
+
+    progress, if given, is called for each track read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.weirdness = []
         self.instruments = {}
@@ -26,39 +111,46 @@ class MidiFile:
         self.pattern_lists = collections.defaultdict(list)
         self.short_format = None
         self.show_continual = None
-        self.read()
+        self.read(progress)
+
+    @shared.instrumented
+    def read(self, progress=None):
+        """read and interpret the midi file to build the internal data collection
 
-    def read(self):
-        """convert the midi file into a csv and read and interpret that to
-        build the internal data collection
+        if the file cannot be parsed here, it is converted using midicsv (if available)
+        progress, if given, is called with a description of each track before reading it
+        and before dividing it into patterns; it can stop the reading by raising an exception
         """
-        outfile = pathlib.Path(self.filename).with_suffix('.csv').name
-        outfile = pathlib.Path('/tmp') / outfile
-        subprocess.run(['midicsv', self.filename, str(outfile)], check=False)
+        with open(self.filename, 'rb') as _in:
+            filedata = memoryview(_in.read())
+        try:
+            events = list(read_smf(filedata, progress))
+        except (ValueError, IndexError, struct.error) as exc:
+            if not shutil.which('midicsv'):
+                raise
+            log(f'{self.filename}: {exc!r}, using midicsv instead')
+            events = read_midicsv(self.filename)
         trackdata = collections.defaultdict(set)
-        with outfile.open() as _in:
-            csvdata = csv.reader(_in)
-            for line in csvdata:
-                track, tick, event, *data = line
-                track = int(track) - 1
-                tick = int(tick)
-                event = event.strip()
-                if track == -1 and event == 'Header':
-                    self.resolution = int(data[2])
-                elif event == 'Title_t':
-                    test = data[0].strip(' "')
-                    if test:
-                        self.instruments[track] = [test, '']
-                elif event == 'Note_on_c':
-                    if not self.instruments[track][1]:
-                        self.instruments[track][1] = int(data[0]) + 1
-                    elif int(data[0]) + 1 != self.instruments[track][1]:
-                        self.weirdness.append('in-track channel change on track {track}'
-                                              ' at time {tick}')
-                    if int(data[2]) != 0:   # don't count velocity set to 0
-                        trackdata[track].add((tick, int(data[1])))
+        for track, tick, event, data in events:
+            track -= 1
+            if track == -1 and event == 'Header':
+                self.resolution = int(data[2])
+            elif event == 'Title_t':
+                test = data[0].strip(' "')
+                if test:
+                    self.instruments[track] = [test, '']
+            elif event == 'Note_on_c':
+                if not self.instruments[track][1]:
+                    self.instruments[track][1] = int(data[0]) + 1
+                elif int(data[0]) + 1 != self.instruments[track][1]:
+                    self.weirdness.append('in-track channel change on track {track}'
+                                          ' at time {tick}')
+                if int(data[2]) != 0:   # don't count velocity set to 0
+                    trackdata[track].add((tick, int(data[1])))
         duration = self.resolution // 4
         for trackno, track in trackdata.items():
+            if progress:
+                progress(f'dividing track {trackno + 1} into patterns')
             pattern_data = collections.defaultdict(
                 lambda: collections.defaultdict(list))
             for timing, pitch in sorted(track):
@@ -66,17 +158,13 @@ class MidiFile:
                 pattern_no = notestart // shared.tick_factor
                 pattern_start = pattern_no * shared.tick_factor
                 pattern_data[pattern_no][pitch].append(notestart - pattern_start)
-            patterns = []
+            pattern_index = shared.PatternIndex()
             pattern_list = []
             for pattern_no, pattern in pattern_data.items():
-                try:
-                    pattern_id = patterns.index(pattern)
-                except ValueError:
-                    pattern_id = len(patterns)
-                    patterns.append(pattern)
+                pattern_id = pattern_index.add(pattern)[0] - 1
                 pattern_list.append((pattern_no, pattern_id))
             # self.patterns[trackno] = [(x, y) for x, y in enumerate(patterns)]
-            self.patterns[trackno] = list(enumerate(patterns))
+            self.patterns[trackno] = list(enumerate(pattern_index.patterns))
             self.pattern_lists[trackno] = pattern_list
         to_pop = []
         for key, val in self.instruments.items():
@@ -85,14 +173,25 @@ class MidiFile:
         for key in to_pop:
             self.instruments.pop(key)
 
-    def process(self, gui):
+    def get_instrument_lists(self):
+        """return the names of the regular instruments and the drum tracks found in the file
+
+        drum tracks that are recognizable as such are returned with their letter(s) attached
+        """
+        nondrums = [x[0] for x in self.instruments.values() if x[1] != shared.drum_channel]
+        drums = [x[0] + " (*)" for x in self.instruments.values() if x[1] == shared.drum_channel]
+        return nondrums, drums
+
+    def process(self, options):
         """Create output for MIDI
 
         this is assuming I only have midi files that use a separate drum track
         (instead of several tracks with one drum instrument each)
         """
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
-        with open(gui.get_general_filename(), "w") as _out:
+        self.short_format = options.short_format
+        self.show_continual = options.full
+        opts = (options.max_events, options.crop_empty)
+        with options.open_output(options.names.get_general_filename(), 'w') as _out:
             self.print_general_data(full=self.show_continual, stream=_out)
         self.prepare_print_instruments()
         # kijken of er dubbele namen zijn
@@ -102,20 +201,20 @@ class MidiFile:
                 dubbel.add('-'.join((data[0], str(trackno))))
             else:
                 test.add(data[0])
-        if gui.check_allinone.isChecked():
-            inst_list = gui.list_items(gui.list_samples)
-            inst_list += [x.rsplit(' ', 1)[0] for x in gui.list_items(gui.mark_samples)]
-            with open(gui.get_general_filename(), 'a') as _out:
-                self.print_all_instruments_full(inst_list, options, _out)
+        if options.all_in_one:
+            inst_list = options.instruments + options.drumsamples
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
+                self.print_all_instruments_full(inst_list, opts, _out)
             return []
         for trackno, name in self.instruments.items():
-            with open(gui.get_instrument_filename(name), 'w') as _out:
-                if gui.check_full.isChecked():
-                    self.print_instrument_full(trackno, options, _out)
+            with options.open_output(options.names.get_instrument_filename(name), 'w') as _out:
+                if options.full:
+                    self.print_instrument_full(trackno, opts, _out)
                 else:
                     self.print_instrument(trackno, _out)
         return []
 
+    @shared.instrumented
     def print_general_data(self, full=False, stream=sys.stdout):
         """create the "overview" file (sample and pattern lists)
         """
@@ -142,6 +241,7 @@ class MidiFile:
         for item in data:
             print(item.rstrip(), file=stream)
 
+    @shared.instrumented
     def print_instrument(self, trackno, stream=sys.stdout):
         """print the events for an instrument as a piano roll
 
@@ -149,6 +249,7 @@ class MidiFile:
         stream is a file-like object to write the output to
         """
         is_drumtrack = self.instruments[trackno][1] == shared.drum_channel
+        empty_event = shared.empty[is_drumtrack]
         for number, pattern in self.patterns[trackno]:
             print(shared.patt_start.format(number + 1), file=stream)
             unlettered = set()
@@ -157,28 +258,29 @@ class MidiFile:
                 if not pattern[pitch]:
                     continue
                 if is_drumtrack:
-                    notestr = shared.get_inst_name(pitch + shared.note2drums)
+                    notestr = shared.drum_letters[pitch]
                     if notestr == '?':
                         unlettered.add(f'no letter yet for `{shared.gm_drums[pitch - 35][1]}`')
+                        key = -1
+                    elif shared.drum_positions[pitch] < 0:
+                        unlettered.add(f'{notestr} not in standard printseq'
+                                       f' {shared.standard_printseq}')
+                        key = -1
                     else:
-                        try:
-                            key = shared.standard_printseq.index(notestr)
-                        except ValueError:
-                            unlettered.add(f'{notestr} not in standard printseq'
-                                           f' {shared.standard_printseq}')
+                        key = shared.drum_positions[pitch]
                 else:
-                    notestr = shared.get_note_name(pitch)
+                    notestr = shared.note_names[pitch]
                     key = pitch
                 printstr = [shared.line_start]
                 index = 0
                 for event in pattern[pitch]:
                     while index < event:
-                        printstr.append(shared.empty[is_drumtrack])
+                        printstr.append(empty_event)
                         index += 1
                     printstr.append(notestr)
                     index += 1
                 while index < shared.per_line:
-                    printstr.append(shared.empty[is_drumtrack])
+                    printstr.append(empty_event)
                     index += 1
                 if not is_drumtrack:
                     printstr[0] = printstr[0][:-1]
@@ -193,12 +295,13 @@ class MidiFile:
             print(x, file=stream)
         return unlettered
 
+    @shared.instrumented
     def prepare_print_instruments(self):
         """build complete timeline for (drum & regular) instrument events
         """
-        self.all_track_notes = collections.defaultdict(
-            lambda: collections.defaultdict(list))
+        self.all_track_notes = collections.defaultdict(dict)
         self.all_notevals = collections.defaultdict(set)
+        self.note_order = {}
         self.total_length = 0
         for trackno, trackdata in self.instruments.items():
             is_drumtrack = trackdata[1] == shared.drum_channel
@@ -206,6 +309,11 @@ class MidiFile:
             patterns = dict(self.patterns[trackno])
             for _, pattdict in self.patterns[trackno]:
                 self.all_notevals[trackno].update(list(pattdict.keys()))
+            if is_drumtrack:
+                self.note_order[trackno] = sorted(self.all_notevals[trackno],
+                                                  key=shared.drum_positions.__getitem__)
+            else:
+                self.note_order[trackno] = sorted(self.all_notevals[trackno], reverse=True)
             pattlist = []
             seq = 0
             for pattseq, pattnum in sorted(self.pattern_lists[trackno]):
@@ -214,30 +322,26 @@ class MidiFile:
                     seq += 1
                 pattlist.append((pattseq, pattnum))
                 seq += 1
+            empty_event = shared.empty[is_drumtrack]
+            tracks = self.all_track_notes[trackno]
+            for note in self.all_notevals[trackno]:
+                if is_drumtrack:
+                    tracks[note] = shared.PatternTimeline(shared.drum_letters[note], empty_event)
+                else:
+                    tracks[note] = shared.PatternTimeline(shared.note_names[note], empty_event)
             for pattseq, pattnum in pattlist:
-                empty_event = shared.empty[is_drumtrack]
                 if pattnum == -1:
                     for note in self.all_notevals[trackno]:
-                        self.all_track_notes[trackno][note].extend([empty_event] * shared.per_line)
+                        tracks[note].extend(shared.per_line)
                     continue
                 for note in self.all_notevals[trackno]:
-                    if note in patterns[pattnum]:
-                        events = patterns[pattnum][note]
-                        for tick in range(shared.per_line):
-                            if tick in events:
-                                if is_drumtrack:
-                                    to_append = shared.get_inst_name(note + shared.note2drums)
-                                else:
-                                    to_append = shared.get_note_name(note)
-                            else:
-                                to_append = empty_event
-                            self.all_track_notes[trackno][note].append(to_append)
-                    else:
-                        self.all_track_notes[trackno][note].extend([empty_event] * shared.per_line)
-            test = len(self.all_track_notes[trackno][note])
-            ## print(test)
-            self.total_length = max(test, self.total_length)
+                    tracks[note].extend(shared.per_line, patterns[pattnum].get(note, ()))
+            if tracks:
+                test = len(pattlist) * shared.per_line
+                ## print(test)
+                self.total_length = max(test, self.total_length)
 
+    @shared.instrumented
     def print_instrument_full(self, trackno, opts, stream=sys.stdout):
         """output an instrument timeline to a separate file/stream
 
@@ -249,35 +353,15 @@ class MidiFile:
         all_track_notes = self.all_track_notes[trackno]
         ## all_notevals = self.all_notevals[trackno]
 
-        empty_event = shared.empty[is_drumtrack]
-        if is_drumtrack:
-            if self.short_format:
-                interval *= 2
-            notes_to_show = list(
-                sorted(self.all_notevals[trackno],
-                       key=lambda x: shared.standard_printseq.index(shared.get_inst_name(
-                           x + shared.note2drums))))
-        else:
-            notes_to_show = list(reversed(sorted(self.all_notevals[trackno])))
+        if is_drumtrack and self.short_format:
+            interval *= 2
 
         sep = shared.eventsep(is_drumtrack, self.short_format)
-        empty_line = sep.join(interval * [empty_event])
-        for eventindex in range(0, self.total_length, interval):
-            if eventindex + interval > self.total_length:
-                empty_line = sep.join((self.total_length - eventindex) * [empty_event])
-            not_printed = True
-            for note in notes_to_show:
-                notes = all_track_notes[note]
-                line = sep.join(notes[eventindex:eventindex + interval])
-                if clear_empty and (line == empty_line or not line):
-                    pass
-                else:
-                    print(line, file=stream)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty[is_drumtrack], file=stream)
-            print('', file=stream)
+        tracks = [all_track_notes[x] for x in self.note_order[trackno]]
+        for lines in shared.iter_lines(tracks, self.total_length, interval, sep, clear_empty):
+            shared.print_lines(lines, shared.empty[is_drumtrack], stream)
 
+    @shared.instrumented
     def print_all_instruments_full(self, instlist, opts, stream=sys.stdout):
         """output all instrument timelines to the "general" file
 
@@ -294,30 +378,20 @@ class MidiFile:
                 is_drumtrack = trackdata[1] == shared.drum_channel
                 sep = shared.eventsep(is_drumtrack, self.short_format)
                 empty_event = shared.empty[is_drumtrack]
-                empty_line = sep.join(interval * [empty_event])
-                if eventindex + interval > self.total_length:
-                    empty_line = sep.join((self.total_length - eventindex) * [empty_event])
                 all_track_notes = self.all_track_notes[trackno]
-                all_notevals = self.all_notevals[trackno]
 
                 if is_drumtrack:
-                    notes_to_show = list(
-                        sorted(all_notevals, key=lambda x: shared.standard_printseq.index(
-                            shared.get_inst_name(x + shared.note2drums))))
                     print('drums:', file=stream)
                 else:
-                    notes_to_show = list(reversed(sorted(all_notevals)))
                     print(f'{instname}:', file=stream)
 
                 not_printed = True
-                for note in notes_to_show:
-                    notes = all_track_notes[note]
-                    line = sep.join(notes[eventindex:eventindex + interval])
-                    if clear_empty and (line == empty_line or not line):
-                        pass
-                    else:
-                        print('  ', line, file=stream)
-                        not_printed = False
+                for note in self.note_order[trackno]:
+                    track = all_track_notes[note]
+                    if clear_empty and not track.has_events(eventindex, eventindex + interval):
+                        continue
+                    print('  ', track.render(eventindex, eventindex + interval, sep), file=stream)
+                    not_printed = False
                 if not_printed:
                     print('  ', empty_event, file=stream)
                 print('', file=stream)
@@ -1,9 +1,12 @@
 """ModReaderGui - data processing for LMMS project file
 """
 import sys
-import pathlib
+import io
+import struct
+import zlib
 import subprocess
 import collections
+import functools
 import pprint
 import logging
 try:
@@ -23,55 +26,103 @@ def get_druminst_order(x):
 
     relies on standard sequence defined in settings
     """
-    y = shared.get_inst_name(x + shared.octave_length + shared.note2drums)
-    return shared.standard_printseq.index(y)
+    return shared.drum_positions[x + shared.octave_length]
+
+
+def get_project_data(filename):
+    """return the XML of a project file as a stream
+
+    a compressed project (.mmpz) consists of the length of the XML as a 4-byte big-endian
+    number followed by the zlib-compressed XML; it is unpacked in memory, if that doesn't
+    work LMMS is asked to do it
+    """
+    with open(filename, 'rb') as _in:
+        data = _in.read()
+    if data.lstrip().startswith(b'<'):
+        return io.BytesIO(data)
+    try:
+        length = struct.unpack('>L', data[:4])[0]
+        data = zlib.decompress(data[4:])
+        if len(data) != length:
+            raise ValueError('unpacked length does not match')
+    except (struct.error, zlib.error, ValueError) as exc:
+        log(f'{filename}: {exc!r}, using lmms dump instead')
+        data = subprocess.run(['lmms', 'dump', filename], capture_output=True,
+                              check=True).stdout
+    return io.BytesIO(data)
 
 
 class MMPFile:
     """Main processing class
+
+    progress, if given, is called for each track read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.short_format = None
         self.show_continual = None
-        self.read()
+        self.read(progress)
 
-    def read(self):
-        """unpack the project file if necessary, then read the XML and interpret
+    @shared.instrumented
+    def read(self, progress=None):
+        """read the project's XML (unpacked if necessary) and interpret
         into an internal data collection
-        """
-        project_file = pathlib.Path(self.filename)
-        mmpz_time = project_file.stat().st_mtime
-        project_name = project_file.stem
-        project_copy = pathlib.Path(f'/tmp/{project_name}.mmp')
-        try:
-            mmp_time = project_copy.stat().st_mtime
-        except FileNotFoundError:
-            mmp_time = 0
-        if mmp_time < mmpz_time:
-            with project_copy.open('w') as _out:
-                subprocess.run(['lmms', 'dump', self.filename], stdout=_out, check=False)
-        data = et.ElementTree(file=str(project_copy))
-        root = data.getroot()
-
-        # getting the regular instruments
-        tracks = root.findall('./song/trackcontainer/track[@type="0"]')
-        # self.tracknames = set([x.get("name") for x in tracks])
-        self.tracknames = {x.get("name") for x in tracks}
 
-        patternlists = collections.defaultdict(list)
-        patterndata = collections.defaultdict(list)
+        progress, if given, is called with a description of each track before reading its
+        patterns; it can stop the reading by raising an exception
+        """
+        self.tracknames = set()
+        self.bbtracknames = []
+        self.pattern_starts = collections.defaultdict(dict)
         trackdata = collections.defaultdict(list)
         trackdata_split = collections.defaultdict(list)
-        self.pattern_starts = collections.defaultdict(dict)
-        for name in self.tracknames:
-            for tracknum, track in enumerate(tracks):
-                if track.get('name') != name:
-                    continue
-                data, data_split, pattstarts = self.read_track(track)
-                trackdata[name].extend(data)
-                trackdata_split[name].extend(data_split)
-                self.pattern_starts[name][tracknum] = pattstarts
+        bbtrackdata = collections.defaultdict(dict)
+        bbtrackdata_split = collections.defaultdict(list)
+        bbtracklen = collections.defaultdict(list)
+        bbeventslist = []
+        tracknum = bbtracknum = 0
+        # read the tracks in one pass, throwing away what's done with as we go
+        parents = []
+        for event, elem in et.iterparse(get_project_data(self.filename),
+                                       events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem.tag)
+                continue
+            parents.pop()
+            if elem.tag == 'track' and parents[1:] == ['song', 'trackcontainer']:
+                if elem.get('type') == '0':
+                    # getting the regular instruments
+                    name = elem.get('name')
+                    if progress:
+                        progress(f'reading track {name}')
+                    self.tracknames.add(name)
+                    data, data_split, pattstarts = self.read_track(elem)
+                    trackdata[name].extend(data)
+                    trackdata_split[name].extend(data_split)
+                    self.pattern_starts[name][tracknum] = pattstarts
+                    tracknum += 1
+                elif elem.get('type') == '1':
+                    # getting the real pattern starts
+                    bbtracknum += 1
+                    for bbtco in elem.findall('bbtco'):
+                        bbeventslist.append((int(bbtco.get('pos')), bbtracknum))
+                elem.clear()
+            elif elem.tag == 'track' and parents[-2:] == ['bbtrack', 'trackcontainer']:
+                # beat/bassline tracks
+                # getting the instruments and patterns per instrument involved
+                name = elem.get('name')
+                if progress:
+                    progress(f'reading beat/bassline track {name}')
+                self.bbtracknames.append(name)
+                data, data_split, pattstarts = self.read_track(elem)
+                for pattnum, pattdata in enumerate(data):
+                    if pattdata[1]:
+                        bbtrackdata[pattnum + 1][name] = pattdata[1]
+                        bbtracklen[pattnum + 1].append(pattdata[2])
+                bbtrackdata_split[name].append(data_split)
+                elem.clear()
+            elif len(parents) < 3:
+                elem.clear()
 
         ## with open('/tmp/trackdata items.1', 'w') as _o:
             ## for name, data in trackdata.items():
@@ -83,6 +134,8 @@ class MMPFile:
                 ## for item in data:
                     ## print('   ', item, file=_o)
 
+        patternlists = collections.defaultdict(list)
+        patterndata = collections.defaultdict(list)
         for name, data in trackdata.items():
             for start, pattern, pattlen in sorted(data):
                 patterndata[name].append((start, pattern, pattlen))
@@ -97,41 +150,18 @@ class MMPFile:
 
         maxpattnum += 1
 
-        patternlists = collections.defaultdict(lambda: maxpattnum * [-1])
+        patternlists = collections.defaultdict(functools.partial(list, maxpattnum * [-1]))
         patterndata = collections.defaultdict(list)
         for name, data in trackdata_split.items():
-            pattnum = 0     # start with 1
-            got_it = []
+            got_it = shared.PatternIndex()
             for seq, pattern, pattlen in sorted(data):
-                try:
-                    pattern_number = got_it.index(sorted(pattern)) + 1
-                except ValueError:
-                    got_it.append(sorted(pattern))
-                    pattnum += 1
+                pattern_number, is_new = got_it.add(sorted(pattern))
+                if is_new:
                     patterndata[name].append((pattern, pattlen))
-                    pattern_number = pattnum
                 patternlists[name][seq] = pattern_number
         self.patternlists_split = patternlists
         self.patterndata_split = patterndata
 
-        # beat/bassline tracks
-        # getting the instruments and patterns per instrument involved
-        bbtracks = root.findall('.//bbtrack/trackcontainer/track')
-        self.bbtracknames = [x.get("name") for x in bbtracks]
-        bbtrackdata = collections.defaultdict(dict)
-        bbtrackdata_split = collections.defaultdict(list)
-        bbtracklen = collections.defaultdict(list)
-        for name in self.bbtracknames:
-            for track in bbtracks:
-                if track.get('name') != name:
-                    continue
-                data, data_split, pattstarts = self.read_track(track)
-                for pattnum, pattdata in enumerate(data):
-                    if pattdata[1]:
-                        bbtrackdata[pattnum + 1][name] = pattdata[1]
-                        bbtracklen[pattnum + 1].append(pattdata[2])
-                bbtrackdata_split[name].append(data_split)
-
         self.bbpatterndata = {}
         for pattnum, pattdata in bbtrackdata.items():
             self.bbpatterndata[pattnum] = (pattdata, max(bbtracklen[pattnum]))
@@ -143,31 +173,33 @@ class MMPFile:
                     drumtracks[num].append((name, track, pattlen))
         self.bbpatterndata_split = drumtracks
 
-        # getting the real pattern starts
-        tracks = root.findall('./song/trackcontainer/track[@type="1"]')
-        bbeventslist = []
-        for tracknum, track in enumerate(tracks):
-            for bbtco in track.findall('bbtco'):
-                pos = int(bbtco.get('pos'))
-                bbeventslist.append((pos, tracknum + 1))
         self.bbpatternlist = list(sorted(bbeventslist))
 
-    def process(self, gui):
+    def get_instrument_lists(self):
+        """return the names of the regular instruments and the drum tracks found in the file
+
+        drum tracks that are recognizable as such are returned with their letter(s) attached
+        """
+        return list(self.tracknames), [f'{x} ({x[0]})' for x in self.bbtracknames]
+
+    def process(self, options):
         """Create output for LMMS project
         """
-        drumsamples, letters, printseq = gui.assigned
-        inst_samples = [gui.list_samples.item(x).text() for x in range(gui.list_samples.count())]
+        self.short_format = options.short_format
+        self.show_continual = options.full
+        drumsamples, letters, printseq = options.drumsamples, options.letters, options.printseq
+        inst_samples = options.instruments
         sample_map = list(zip(drumsamples, letters))
         drumkits = [x for x, y in sample_map if y == '*']
 
-        with open(gui.get_general_filename(), "w") as _out:
+        with options.open_output(options.names.get_general_filename(), 'w') as _out:
             #  log('calling self.print_general_data with args {} {} {}'.format(
             #      inst_samples, self.check_full.isChecked(), _out))
             #  self.print_general_data(inst_samples, self.check_full.isChecked(),
             #      _out)
-            log(f'calling print_general_data with args {drumkits} {gui.check_full.isChecked()}'
+            log(f'calling print_general_data with args {drumkits} {options.full}'
                 ' {_out}')
-            gui.print_general_data(drumkits, self.show_continual, _out)
+            self.print_general_data(drumkits, self.show_continual, _out)
 
         #  log('calling self.prepare_print_instruments with argument {}'.format(
         #      [x for x, y in sample_map if y == '*']))
@@ -177,35 +209,35 @@ class MMPFile:
         if self.bbtracknames:
             log(f'calling prepare_print_beat_bassline with args {sample_map} {printseq}')
             self.prepare_print_beat_bassline(sample_map, printseq)
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
-        if gui.check_allinone.isChecked():
+        opts = (options.max_events, options.crop_empty)
+        if options.all_in_one:
             # instlist = [x.rsplit(' ', 1) for x in list_items(self.list_samples)]
-            with open(gui.get_general_filename(), 'a') as _out:
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
                 log(f'calling print_all_instruments_full with args {inst_samples} {printseq}'
-                    ' {options} {_out}')
-                self.print_all_instruments_full(inst_samples, printseq, options, _out)
+                    ' {opts} {_out}')
+                self.print_all_instruments_full(inst_samples, printseq, opts, _out)
             return []
 
         if [x for x, y in sample_map if y != '*']:
             if self.bbtracknames:
-                with open(gui.get_instrument_filename('bbdrums'), "w") as _out:
-                    if gui.check_full.isChecked():
-                        log(f'calling print_beat_bassline_full with args {printseq} {options} {_out}')
-                        self.print_beat_bassline_full(printseq, options, _out=_out)
+                with options.open_output(options.names.get_instrument_filename('bbdrums')) as _out:
+                    if options.full:
+                        log(f'calling print_beat_bassline_full with args {printseq} {opts} {_out}')
+                        self.print_beat_bassline_full(printseq, opts, _out=_out)
                     else:
                         log(f'calling print_beat_bassline with args {sample_map} {printseq} {_out}')
                         self.print_beat_bassline(sample_map, printseq, _out=_out)
             else:
-                with open(gui.get_drums_filename(), "w") as _out:
+                with options.open_output(options.names.get_drums_filename(), 'w') as _out:
                     log(f'calling print_drums with args {sample_map} {printseq} {_out}')
                     self.print_drums(sample_map, printseq, _out)
 
         all_unlettered = []
         for trackname in [x for x, y in sample_map if y == '*']:
-            with open(gui.get_instrument_filename(trackname), "w") as _out:
-                if gui.check_full.isChecked():
-                    log(f'calling print_instrument_full with args {trackname} {options} {_out}')
-                    self.print_instrument_full(trackname, options, _out=_out)
+            with options.open_output(options.names.get_instrument_filename(trackname), 'w') as _out:
+                if options.full:
+                    log(f'calling print_instrument_full with args {trackname} {opts} {_out}')
+                    self.print_instrument_full(trackname, opts, _out=_out)
                     unlettered = []
                 else:
                     log(f'calling print_drumtrack with args {trackname} {_out}')
@@ -214,10 +246,10 @@ class MMPFile:
                 all_unlettered.append(f'track {trackname}: {line}')
 
         for trackname in inst_samples:
-            with open(gui.get_instrument_filename(trackname), "w") as _out:
-                if gui.check_full.isChecked():
-                    log(f'calling print_instrument_full with args {trackname} {options} {_out}')
-                    self.print_instrument_full(trackname, options, _out=_out)
+            with options.open_output(options.names.get_instrument_filename(trackname), 'w') as _out:
+                if options.full:
+                    log(f'calling print_instrument_full with args {trackname} {opts} {_out}')
+                    self.print_instrument_full(trackname, opts, _out=_out)
                 else:
                     log(f'calling print_instrument with args {trackname} {_out}')
                     self.print_instrument(trackname, _out)
@@ -261,6 +293,7 @@ class MMPFile:
             patterns_split.append((pattstart_split, notes_split, pattlen_split))
         return patterns, patterns_split, pattstarts
 
+    @shared.instrumented
     def print_general_data(self, sample_list=None, full=False, _out=sys.stdout):
         """create the "overview" file (sample and pattern lists)
         """
@@ -296,6 +329,7 @@ class MMPFile:
     # - er worden beat/bassline tracks gebruikt
     #    hier moet ik nog in voorzien dat er niet alleen drums maar ook bas oid meedoet
     #    theoretisch, want zelf gebruik ik dat eigenlijk niet?
+    @shared.instrumented
     def print_beat_bassline(self, sample_list, printseq, _out=sys.stdout):
         """collect the beat_bassline events and print them pattern by pattern
         """
@@ -326,6 +360,7 @@ class MMPFile:
             print('', file=_out)
 
     # - er word(t)(en) (een) midi drumtrack(s) gebruikt
+    @shared.instrumented
     def print_drumtrack(self, trackname, _out=sys.stdout):
         """collect the drumtrack events and print them pattern by pattern
         """
@@ -336,7 +371,7 @@ class MMPFile:
             events = collections.defaultdict(list)
             for pitch, ev in pattern:
                 druminst = pitch + shared.octave_length + shared.note2drums
-                notestr = shared.get_inst_name(druminst)
+                notestr = shared.drum_letters[pitch + shared.octave_length]
                 if notestr == '?':
                     unlettered.add(f'no letter yet for `{shared.gm_drums[druminst][1]}`')
                 events[notestr].append(ev)
@@ -356,10 +391,12 @@ class MMPFile:
         return unlettered
 
     # - er worden aparte instrumenten gebruikt (to be implemented)
+    @shared.instrumented
     def print_drums(self, sample_list, printseq, _out=sys.stdout):
         """collect the drum instrument events and print them pattern by pattern
         """
 
+    @shared.instrumented
     def print_instrument(self, trackname, _out=sys.stdout):
         """print the events for an instrument as a piano roll
 
@@ -388,6 +425,7 @@ class MMPFile:
                     print(' '.join(printable), file=_out)
             print('', file=_out)
 
+    @shared.instrumented
     def prepare_print_instruments(self, druminst=None):
         """build complete timeline for (drum & regular) instrument events
         """
@@ -396,6 +434,7 @@ class MMPFile:
         self.druminst = druminst
         self.notes_data_dict = collections.defaultdict(dict)
         self.all_notes = collections.defaultdict(set)
+        self.note_order = {}
         self.total_length = 0
         for trackname in self.tracknames:
             is_drumtrack = trackname in self.druminst
@@ -404,6 +443,11 @@ class MMPFile:
             lng = events[-1][1]  # correctie want lng is alleen de lengte van de gespeelde noten
             for pattern in self.patterndata[trackname]:
                 self.all_notes[trackname].update([x[0] for x in pattern[1]])
+            if is_drumtrack:
+                self.note_order[trackname] = sorted(self.all_notes[trackname],
+                                                    key=get_druminst_order)
+            else:
+                self.note_order[trackname] = sorted(self.all_notes[trackname], reverse=True)
             ## total_length = int((start + len) / shared.timing_unit)
             current_length = (start + lng) // shared.timing_unit + 1
             self.total_length = max((current_length, self.total_length))
@@ -415,13 +459,13 @@ class MMPFile:
                     ## idx = int((start + timing) / shared.timing_unit)
                     idx = (start + timing) // shared.timing_unit
                     if is_drumtrack:
-                        notename = shared.get_inst_name(note + shared.octave_length
-                                                        + shared.note2drums)
+                        notename = shared.drum_letters[note + shared.octave_length]
                     else:
                         notename = shared.get_note_name(note + shared.octave_length)
                     self.notes_data_dict[trackname][note][idx] = notename
             ## print(notes_data_dict, file=_out)
 
+    @shared.instrumented
     def print_instrument_full(self, trackname, opts, _out=sys.stdout):
         """output an instrument timeline to a separate file/stream
 
@@ -432,9 +476,7 @@ class MMPFile:
         is_drumtrack = trackname in self.druminst
         if is_drumtrack:
             interval *= 2
-            notes_to_show = list(sorted(self.all_notes[trackname], key=get_druminst_order))
-        else:
-            notes_to_show = list(reversed(sorted(self.all_notes[trackname])))
+        notes_to_show = self.note_order[trackname]
         sep = shared.sep[is_drumtrack]
         empty_line = sep.join(interval * [shared.empty[is_drumtrack]])
         for eventindex in range(0, self.total_length, interval):
@@ -454,6 +496,7 @@ class MMPFile:
                 print(empty_line, file=_out)
             print('', file=_out)
 
+    @shared.instrumented
     def prepare_print_beat_bassline(self, sample_list, printseq):
         """build complete timeline for beat_bassline events
         """
@@ -478,6 +521,7 @@ class MMPFile:
                         indx = (pattstart + timing) // shared.timing_unit
                         self.notes_data_dict['bb'][note][indx] = note
 
+    @shared.instrumented
     def print_beat_bassline_full(self, printseq, opts, _out=sys.stdout):
         """output beat_bassline timeline to a separate file/stream
 
@@ -511,14 +555,17 @@ class MMPFile:
             print('', file=_out)
 
     # net als print_drums (via aparte samples) ook deze twee niet geïmplementeerd:
+    @shared.instrumented
     def prepare_print_drums(self, sample_list):
         """build complete timeline for drumtrack events
         """
 
+    @shared.instrumented
     def print_drums_full(self, sample_list, printseq, _out=sys.stdout):
         """build complete timeline for combined drum instrument events
         """
 
+    @shared.instrumented
     def print_all_instruments_full(self, instlist, printseq, opts, _out=sys.stdout):
         """output all instrument timelines to the "general" file
 
@@ -532,10 +579,7 @@ class MMPFile:
             for trackname in instlist:  # denk aan volgorde!
                 print(f'{trackname}:', file=_out)
                 is_drumtrack = trackname in self.druminst
-                if is_drumtrack:
-                    notes_to_show = list(sorted(self.all_notes[trackname], key=get_druminst_order))
-                else:
-                    notes_to_show = list(reversed(sorted(self.all_notes[trackname])))
+                notes_to_show = self.note_order[trackname]
                 sep = shared.eventsep(is_drumtrack, self.short_format)
                 empty = shared.empty[is_drumtrack]
                 empty_line = sep.join(interval * [empty])
@@ -3,7 +3,13 @@
 """
 import sys
 import collections
+import functools
+import struct
 import logging
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from readerapp import shared
 
 
@@ -30,6 +36,11 @@ noteval = dict(zip([
  C-6  C#6  D-6  D#6  E-6  F-6  F#6  G-6  G#6  A-6  A#6  B-6
 """.split()]))
 maxpattlen = 64
+note_names = list(noteval.values())
+if np is not None:
+    # lookup table for translating periods to indexes into note_names, -1 is unknown period
+    note_table = np.full(4096, -1, dtype=np.int16)
+    note_table[list(noteval)] = range(len(noteval))
 
 
 def getstring(data):
@@ -82,85 +93,132 @@ def get_notedata(data):
     return sampnum, note, effectnum, effectparm
 
 
-class ModFile:
+def get_pattern_notes(patterns):
+    """return the notes in each pattern together with the pattern length
+
+    a pattern ends after the row with a pattern break (effect 13); as in the original
+    playing routine, nothing is read after the event containing the break
+    yields pattern number, length and a list of (row, sample number, note) per pattern
+    """
+    for pattnum, pattern in patterns.items():
+        notes = []
+        leng = maxpattlen
+        for ix, track in enumerate(pattern):
+            for event in track:
+                samp, note, effect, _ = get_notedata(event)
+                if note:
+                    notes.append((ix, samp, note))
+                if effect == 13:
+                    leng = ix + 1
+                    break
+            if leng != maxpattlen:
+                break
+        yield pattnum, leng, notes
+
+
+def get_pattern_notes_numpy(patterns):
+    """same as get_pattern_notes, but decodes all events in one go using NumPy
+
+    patterns is an array of (pattern, row, channel, event byte) values
+    """
+    pattcount, _, channelcount, _ = patterns.shape
+    events = patterns.reshape(pattcount, -1, 4).astype(np.uint16, copy=False)
+    samps = (events[..., 0] & 0xF0) | (events[..., 2] >> 4)
+    periods = ((events[..., 0] & 0x0F) << 8) | events[..., 1]
+    breaks = (events[..., 2] & 0x0F) == 13
+    # the last event read for each pattern: the first one with a break, or the last one
+    has_break = breaks.any(axis=1)
+    last_event = np.where(has_break, breaks.argmax(axis=1), events.shape[1] - 1)
+    lengths = np.where(has_break, last_event // channelcount + 1, maxpattlen)
+    mask = (periods > 0) & (np.arange(events.shape[1]) <= last_event[:, None])
+    pattnums, eventnums = np.nonzero(mask)
+    notes = note_table[periods[pattnums, eventnums]]
+    if (notes < 0).any():
+        raise KeyError(int(periods[pattnums, eventnums][notes < 0][0]))
+    rows = (eventnums // channelcount).tolist()
+    samps = samps[pattnums, eventnums].tolist()
+    notes = [note_names[x] for x in notes.tolist()]
+    bounds = np.searchsorted(pattnums, np.arange(pattcount + 1)).tolist()
+    for pattnum, leng in enumerate(lengths.tolist()):
+        start, end = bounds[pattnum], bounds[pattnum + 1]
+        yield pattnum, leng, list(zip(rows[start:end], samps[start:end], notes[start:end]))
+
+
+class ModFile(shared.TrackerModule):
     """Main processing class
+
+    progress, if given, is called for each pattern read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.samples = {}
         self.patterns = {}
         self.short_format = None
         self.show_continual = None
         ## self.patterns = collections.defaultdict(lambda: collections.defaultdict(list))
-        self.read()
+        self.read(progress)
 
-    def read(self):
+    @shared.instrumented
+    def read(self, progress=None):
         """read the file via structures into an internal data collection
 
-        instead of repositioning while reading, why not read the entire file first
-        and then (re)position in memory?
+        the entire file is read first, the parts are then taken from memory
+        progress, if given, is called with a description of each pattern before reading it;
+        it can stop the reading by raising an exception
         """
         with open(self.filename, 'rb') as _in:
-
-            self.name = str(_in.read(20), encoding='ascii')
-            for x in range(31):
-                name, stats = get_sample(_in.read(30))
-                if name or stats[:2] not in ([0, 0], [1, 0], [1, 0]):
-                    self.samples[x] = name, stats
-
-            songlength = ord(_in.read(1))
-            self.restart = ord(_in.read(1))
-            self.playseq, self.highpatt = get_playseq(_in.read(128), songlength)
-            self.modtype = str(_in.read(4), encoding='ascii')
-            if self.modtype in ('M.K.', '4CHN', 'FLT4'):
-                channelcount = 4
-            elif self.modtype in ('6CHN',):
-                channelcount = 6
-            elif self.modtype in ('8CHN', 'FLT8'):
-                channelcount = 8
-
+            filedata = memoryview(_in.read())
+
+        self.name = str(filedata[:20], encoding='ascii')
+        for x in range(31):
+            name, stats = get_sample(filedata[20 + x * 30:50 + x * 30])
+            if name or stats[:2] not in ([0, 0], [1, 0], [1, 0]):
+                self.samples[x] = name, stats
+
+        songlength = filedata[950]
+        self.restart = filedata[951]
+        self.playseq, self.highpatt = get_playseq(filedata[952:1080], songlength)
+        self.modtype = str(filedata[1080:1084], encoding='ascii')
+        if self.modtype in ('M.K.', '4CHN', 'FLT4'):
+            channelcount = 4
+        elif self.modtype in ('6CHN',):
+            channelcount = 6
+        elif self.modtype in ('8CHN', 'FLT8'):
+            channelcount = 8
+
+        pattstart = 1084
+        pattend = pattstart + (self.highpatt + 1) * maxpattlen * channelcount * 4
+        if len(filedata) < pattend:
+            raise ValueError('Not a complete module')
+        if np is None:
+            events = struct.iter_unpack('4B', filedata[pattstart:pattend])
             for i in range(self.highpatt + 1):
-                pattern = []
-                for j in range(maxpattlen):
-                    track = []
-                    for k in range(channelcount):
-                        ## self.patterns[x][y].append([x for x in _in.read(4)])
-                        track.append(list(_in.read(4)))
-                    pattern.append(track)
-                self.patterns[i] = pattern
+                self.patterns[i] = [[next(events) for k in range(channelcount)]
+                                    for j in range(maxpattlen)]
+            pattern_notes = get_pattern_notes(self.patterns)
+        else:
+            # widened so that the events can still be decoded with get_notedata
+            patterns = np.frombuffer(filedata[pattstart:pattend], dtype=np.uint8).reshape(
+                self.highpatt + 1, maxpattlen, channelcount, 4).astype(np.uint16)
+            self.patterns = dict(enumerate(patterns))
+            pattern_notes = get_pattern_notes_numpy(patterns)
 
         data = collections.defaultdict(lambda: collections.defaultdict(list))
         lentab = []
-        for pattnum, pattern in self.patterns.items():
-            ## log('pattern: {}'.format(pattnum))
+        for pattnum, leng, notes in pattern_notes:
+            if progress:
+                progress(f'reading pattern {pattnum + 1} of {self.highpatt + 1}')
             sample_list = set()
-            last_event = False
-            for ix, track in enumerate(pattern):
-                ## log('  event {}'.format(ix))
-                for event in track:
-                    ## log('   track {}'.format(track.index(event)))
-                    samp, note, effect, _ = get_notedata(event)
-                    ## if samp or note or effect:
-                        ## log('    notedata: {} {} {}'.format(samp, note, effect))
-                    if note:
-                        data[samp][pattnum].append((ix, note))
-                        sample_list.add(samp)
-                    if effect == 13:
-                        leng = ix + 1
-                        for samp in sample_list:
-                            data[samp][pattnum].insert(0, leng)
-                        last_event = True
-                        break
-                if last_event:
-                    break
-            if not last_event:
-                leng = maxpattlen
-                for samp in sample_list:
-                    data[samp][pattnum].insert(0, leng)
+            for ix, samp, note in notes:
+                data[samp][pattnum].append((ix, note))
+                sample_list.add(samp)
+            for samp in sample_list:
+                data[samp][pattnum].insert(0, leng)
             lentab.append((pattnum, leng))
 
         newlentab = {}
-        self._pattern_data = collections.defaultdict(lambda: collections.defaultdict(list))
+        self._pattern_data = collections.defaultdict(
+            functools.partial(collections.defaultdict, list))
         ophogen = 0
         samples = [x for x in data if x]
         for pattnum, pattlen in lentab:
@@ -199,74 +257,70 @@ class ModFile:
                         self._pattern_data[samp][pattnum + ophogen] = data[samp][pattnum]
             if split:
                 ophogen += 1
-        self.lengths = []
+        self.play_lengths = []
         for x in self.playseq:
-            self.lengths.extend(newlentab[x])
+            self.play_lengths.extend(newlentab[x])
 
-    def process(self, gui):
+    def get_instrument_lists(self):
+        """return the names of the regular instruments and the drum tracks found in the file
+
+        drum tracks that are recognizable as such are returned with their letter(s) attached
+        """
+        return [x[0] for x in self.samples.values() if x[0]], []
+
+    def process(self, options):
         """Create output for NoiseTracker/SoundTracker/MadTracker module
         """
+        self.short_format = options.short_format
+        self.show_continual = options.full
         drums = []
         nondrums = []
-        samples, letters, printseq = gui.assigned
+        samples, letters, printseq = options.drumsamples, options.letters, options.printseq
 
-        for num, data in gui.samples.items():
+        for num, data in self.samples.items():
             if data[0] in samples:
                 ix = samples.index(data[0])
                 drums.append((num + 1, letters[ix]))
 
-        for name in gui.list_items(gui.list_samples):
-            ix = {y[0]: x for x, y in gui.samples.items()}[name]
+        for name in options.instruments:
+            ix = {y[0]: x for x, y in self.samples.items()}[name]
             nondrums.append((ix + 1, name))
 
-        with open(gui.get_general_filename(), "w") as out:
+        with options.open_output(options.names.get_general_filename(), 'w') as out:
             if drums:
-                self.print_general_data(drums, gui.show_continual, out)
+                self.print_general_data(drums, self.show_continual, out)
             else:
-                self.print_general_data(full=gui.show_continual, _out=out)
+                self.print_general_data(full=self.show_continual, _out=out)
         self.prepare_print_instruments(nondrums)
         self.prepare_print_drums(printseq)
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
-        if gui.check_allinone.isChecked():
-            druminst = [(x, y) for x, y in drums if len(y) == 1]
-            log(f'calling print_all_instruments_full with args {nondrums} {druminst} {printseq} '
-                '{options} {self.get_general_filename()}')
-            with open(gui.get_general_filename(), 'a') as _out:
-                self.print_all_instruments_full(nondrums, druminst, printseq, options, _out)
+        opts = (options.max_events, options.crop_empty)
+        if options.all_in_one:
+            drumseq = sorted((y for x, y in drums if len(y) == 1), key=printseq.index)
+            log(f'calling print_all_instruments_full with args {nondrums} {drumseq} {opts}')
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
+                self.print_all_instruments_full(nondrums, drumseq, opts, _out)
             return []
         if drums:
-            with open(gui.get_drums_filename(), "w") as out:
-                if gui.check_full.isChecked():
-                    self.print_drums_full(printseq, options, out)
+            with options.open_output(options.names.get_drums_filename(), 'w') as out:
+                if options.full:
+                    self.print_drums_full(printseq, opts, out)
                 else:
                     self.print_drums(printseq, out)
         for number, name in nondrums:
-            with open(gui.get_instrument_filename(name), "w") as out:
-                if gui.check_full.isChecked():
-                    self.print_instrument_full(number, options, out)
+            with options.open_output(options.names.get_instrument_filename(name), 'w') as out:
+                if options.full:
+                    self.print_instrument_full(number, opts, out)
                 else:
                     self.print_instrument(number, out)
         return []
 
+    @shared.instrumented
     def remove_duplicate_patterns(self, sampnum):
         """show patterns only once for incontiguous timelines
         """
-        renumber = collections.defaultdict(dict)
-        pattern_list = []
-        for pattnum, patt in self._pattern_data[sampnum].items():
-            try:
-                new_pattnum = pattern_list.index(patt) + 1
-            except ValueError:
-                pattern_list.append(patt)
-                new_pattnum = len(pattern_list)
-            renumber[pattnum] = new_pattnum
-        self.pattern_data[sampnum] = pattern_list
-        for seq in self.playseq:
-            if seq in renumber:
-                self.playseqs[sampnum].append(renumber[seq])
-            else:
-                self.playseqs[sampnum].append(-1)
+        self.renumber_patterns(sampnum, self._pattern_data[sampnum].items(), self.playseq)
 
+    @shared.instrumented
     def remove_duplicate_drum_patterns(self, samplist):
         """show patterns only once for incontiguous timelines
         """
@@ -300,22 +354,9 @@ class ModFile:
                     drumpatterns[pattnum][letter].sort()
         for pattnum in drumpatterns:
             drumpatterns[pattnum]['len'] = pattlengths[pattnum]
-        renumber = collections.defaultdict(dict)
-        pattern_list = []
-        for pattnum, patt in drumpatterns.items():
-            try:
-                new_pattnum = pattern_list.index(patt) + 1
-            except ValueError:
-                pattern_list.append(patt)
-                new_pattnum = len(pattern_list)
-            renumber[pattnum] = new_pattnum
-        self.pattern_data['drums'] = pattern_list
-        for seq in self.playseq:
-            if seq in renumber:
-                self.playseqs['drums'].append(renumber[seq])
-            else:
-                self.playseqs['drums'].append(-1)
+        self.renumber_patterns('drums', drumpatterns.items(), self.playseq)
 
+    @shared.instrumented
     def print_general_data(self, sample_list=None, full=False, _out=sys.stdout):
         """create the "overview" file (sample and pattern lists)
 
@@ -361,6 +402,7 @@ class ModFile:
         for text in data:
             print(text.rstrip(), file=_out)
 
+    @shared.instrumented
     def print_drums(self, printseq, _out=sys.stdout):
         """collect the drum sample events and print them together
         """
@@ -382,14 +424,14 @@ class ModFile:
                     ## print('', file=_out)
             print('', file=_out)
 
+    @shared.instrumented
     def print_instrument(self, sample, _out=sys.stdout):
         """print the events for an instrument as a piano roll
 
         sample is the number of the sample to print data for
         stream is a file-like object to write the output to
         """
-        for pattnum, pattern in enumerate(self.pattern_data[sample]):
-            pattlen = pattern.pop(0)
+        for pattnum, (pattlen, *pattern) in enumerate(self.pattern_data[sample]):
             print(shared.patt_start.format(pattnum + 1), file=_out)  # display starting with 1
             notes = collections.defaultdict(list)
             for timing, note in pattern:
@@ -405,180 +447,28 @@ class ModFile:
                 print(' '.join(printable), file=_out)
             print('', file=_out)
 
-    def prepare_print_drums(self, printseq):
-        """build complete timeline for drum instrument events
-
-        sample_list is a list of pattern numbers associated with the instruments
-        to print on this event, e.g. ((1, 'b'), (2, 's'), (4, 'bs'), (7, 'bsh'))
-        printseq indicates the sequence to print these top to bottom e.g. 'hsb'
-        stream is a file-like object to write the output to
-        """
-        self.all_drum_tracks = collections.defaultdict(list)
-        for pattseq, pattnum in enumerate(self.playseqs['drums']):
-            if pattnum == -1:
-                pattlen = self.lengths[pattseq]
-                for inst in printseq:
-                    self.all_drum_tracks[inst].extend([shared.empty_drums] * pattlen)
-                continue
-            pattern = self.pattern_data['drums'][pattnum - 1]
-            for inst in printseq:
-                events = [x[0] for x in pattern[inst]]
-                for i in range(pattern['len']):
-                    to_append = inst if i in events else shared.empty_drums
-                    self.all_drum_tracks[inst].append(to_append)
-
-    def print_drums_full(self, printseq, opts, _out=sys.stdout):
-        """output the drums timeline to a separate file/stream
-
-        printseq indicates the top-to-bottom sequence of instruments
-        opts indicates how many events per line and whether to print "empty" lines
-        """
-        total_length = sum(self.lengths)
-        interval, clear_empty = opts
-        if self.short_format:
-            interval *= 2
-        sep = shared.eventsep(True, self.short_format)
-        # empty = interval * shared.empty_drums
-        for eventindex in range(0, total_length, interval):
-            # if eventindex + interval > total_length:
-            #     empty = (total_length - eventindex) * shared.empty_drums
-            not_printed = True
-            for inst in printseq:
-                tracks = self.all_drum_tracks[inst]
-                line = sep.join(tracks[eventindex:eventindex + interval])
-                test_empty_line = all(x == shared.empty_drums for x in
-                                      tracks[eventindex:eventindex + interval])
-                ## if clear_empty and (line == empty or not line):
-                if clear_empty and (test_empty_line or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_drums, file=_out)
-            print('', file=_out)
-
-    def prepare_print_instruments(self, sample_list):
-        """build complete timeline for all regular instrument events
+    def get_note_order(self, note):
+        """return the key to sort the notes of an instrument on (printed highest first)
         """
-        self.all_note_tracks = collections.defaultdict(lambda: collections.defaultdict(list))
-        self.all_notes = collections.defaultdict(set)
-        # interval, clear_empty = opts
-
-        for sample, _ in sample_list:
-
-            pattdict = collections.defaultdict(lambda: collections.defaultdict(list))
-            pattdata = self.pattern_data[sample]
-            for pattnum, pattern in enumerate(pattdata):
-                for item in pattern:
-                    try:
-                        timing, note = item
-                    except TypeError:
-                        continue
-                    pattdict[pattnum + 1][note].append(timing)
-                    self.all_notes[sample].add(note)
-
-            all_notes = list(reversed(sorted(self.all_notes[sample], key=shared.getnotenum)))
-            playseq = self.playseqs[sample]
-            for pattseq, pattnum in enumerate(playseq):
-                pattlen = self.lengths[pattseq]
-                if pattnum == -1:
-                    # for note in self.all_notes[sample]:
-                    for note in all_notes:
-                        self.all_note_tracks[sample][note].extend([shared.empty_note] * pattlen)
-                    continue
-                pattern = pattdict[pattnum]
-                for note in all_notes:
-                    events = pattern[note]
-                    for i in range(pattlen):
-                        to_append = note if i in events else shared.empty_note
-                        self.all_note_tracks[sample][note].append(to_append)
+        return shared.getnotenum(note)
 
-    def print_instrument_full(self, sample, opts, _out=sys.stdout):
-        """output an instrument timeline to a separate file/stream
+    def get_note_patterns(self, sample):
+        """return the unique patterns for a regular instrument
 
-        sample indicates the instrument to process
-        opts indicates how many events per line and whether to print "empty" lines
+        the stored patterns hold the length followed by (tick, note) pairs
         """
-        total_length = sum(self.lengths)
-        interval, clear_empty = opts
-
-        if interval == -1:
-            interval = total_length
-        # empty = ' '.join(interval * [shared.empty_note])
-        for eventindex in range(0, total_length, interval):
-            # if eventindex + interval > total_length:
-            #     empty = ' '.join((total_length - eventindex) * [shared.empty_note])
-            not_printed = True
-            for note in reversed(sorted(self.all_notes[sample],
-                                        key=shared.getnotenum)):
-                tracks = self.all_note_tracks[sample][note]
-                line = ' '.join(tracks[eventindex:eventindex + interval])
-                test_empty_line = all(x == shared.empty_note for x in
-                                      tracks[eventindex:eventindex + interval])
-                if clear_empty and (test_empty_line or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_note, file=_out)
-            print('', file=_out)
-
-    def print_all_instruments_full(self, instlist, druminst, drumseq, opts, stream=sys.stdout):
-        """output all instrument timelines to the "general" file
-
-        instlist indicates the top-to-bottom sequence of instruments
-        drumseq indicates the top-to-bottom sequence of drum instruments
-        opts indicates how many events per line and whether to print "empty" lines
+        result = []
+        for pattlen, *events in self.pattern_data[sample]:
+            pattern = collections.defaultdict(list, len=pattlen)
+            for timing, note in events:
+                pattern[note].append(timing)
+            result.append(pattern)
+        return result
+
+    def get_drum_patterns(self):
+        """return the unique patterns for the drums
+
+        the stored patterns hold (tick, note) pairs per drum letter
         """
-
-        total_length = sum(self.lengths)
-        interval, clear_empty = opts
-        #  inst_dict = {y:x for x, y in inst_list}
-        #  instlist = [(inst_dict[y], y) for x, y in instlist_old]
-        empty_drum_event = shared.empty_drums
-
-        for eventindex in range(0, total_length, interval):
-
-            sep = ' '
-            ## if eventindex + interval > total_length:
-                ## empty = sep.join((total_length - eventindex) * [shared.empty_note])
-            for sample, instname in instlist:
-
-                print(f'{instname}:', file=stream)
-                not_printed = True
-                for note in reversed(sorted(self.all_notes[sample], key=shared.getnotenum)):
-                    tracks = self.all_note_tracks[sample][note]
-                    line = sep.join(tracks[eventindex:eventindex + interval])
-                    test_empty_line = all(x == shared.empty_note for x in
-                                          tracks[eventindex:eventindex + interval])
-                    if clear_empty and (test_empty_line or not line):
-                        pass
-                    else:
-                        print('  ', line, file=stream)
-                        not_printed = False
-                if not_printed:
-                    print('  ', shared.empty_note, file=stream)
-                print('', file=stream)
-
-            sep = shared.eventsep(True, self.short_format)
-            ## if eventindex + interval > total_length:
-                ## empty = (total_length - eventindex) * shared.empty_drums
-            print('drums:', file=stream)
-            not_printed = True
-            for _, instlett in sorted(druminst, key=lambda x: drumseq.index(x[1])):
-                tracks = self.all_drum_tracks[instlett]
-                line = sep.join(tracks[eventindex:eventindex + interval])
-                test_empty_line = all(x == empty_drum_event for x in
-                                      tracks[eventindex:eventindex + interval])
-                if clear_empty and (test_empty_line or not line):
-                    pass
-                else:
-                    print('  ', line, file=stream)
-                    not_printed = False
-            if not_printed:
-                print('  ', empty_drum_event, file=stream)
-            print('', file=stream)
-
-            print('', file=stream)
+        return [{x: y if x == 'len' else [z[0] for z in y] for x, y in pattern.items()}
+                for pattern in self.pattern_data['drums']]
@@ -1,7 +1,10 @@
 """ModReaderGui - data processing for Reaper project file
 """
 import sys
+import re
 import collections
+import heapq
+import itertools
 import pprint
 import logging
 from readerapp import shared
@@ -12,10 +15,21 @@ def log(inp):
     logging.info(inp)
 
 
+# the lines we're interested in: midi events (with their fields split up)
+# and the lines handled by RppFile.procs (keyword and the rest of the line)
+tokens = re.compile(r"""^[ \t]*(?:
+    E[ \t]+(\d+)[ \t]+([0-9a-fA-F])([0-9a-fA-F])[ \t]+([0-9a-fA-F]+)[ \t]+([0-9a-fA-F]+)[^\r\n]*
+    | (<TRACK|NAME|<ITEM|<SOURCE|HASDATA|>)(?:[ \t]+([^\r\n]*?))?[ \t]*
+    )\r?$""", re.MULTILINE | re.VERBOSE)
+
+
 class RppFile:
     """Main processing class
+
+    when logging at debug level, the pattern data as read is dumped to /tmp for inspection
+    progress, if given, is called for each track read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.procs = {
             '<TRACK': self.start_track,
@@ -23,7 +37,6 @@ class RppFile:
             '<ITEM': self.start_item,
             '<SOURCE': self.start_source,
             'HASDATA': self.start_data,
-            'E': self.process_event,
             '>': self.finalize}
 
         self.weirdness = []
@@ -34,7 +47,7 @@ class RppFile:
         self.pattern_list = collections.defaultdict(list)
         self.short_format = None
         self.show_continual = None
-        self.read()
+        self.read(progress)
 
     def start_track(self, data):
         """identify track, e.g.
@@ -56,7 +69,7 @@ class RppFile:
         else:
             self.pattern_props = {'name': name}
 
-    def start_item(self):  # , data):
+    def start_item(self, data):
         """start of the block containing the pattern e.g.
           <ITEM
         """
@@ -85,19 +98,14 @@ class RppFile:
         self.track_start = True
         self.pattern_events = collections.defaultdict(list)
 
-    def process_event(self, data):
+    def process_event(self, tick, evtype, channel, pitch, velocity):
         """note on/off and other midi events, e.g.
         E 0 c0 14 00
+        arrives here as 0, 'c', '0', 0x14, '00'
         """
         if self.ignore:
             return
         ## log("in process_event: {}".format(data))
-        data = data.split()
-        tick = int(data[0])
-        evtype = data[1][0]
-        channel = data[1][1]
-        pitch = int(data[2], base=16)
-        velocity = data[3]
         self.timing += tick
         if self.track_start or evtype == 'c':   # start new pattern
             if self.pattern_events:
@@ -126,7 +134,7 @@ class RppFile:
         self.pattern_events[pitch].append(now)
         self.pattern_length = now
 
-    def finalize(self):  # , data):
+    def finalize(self, data):
         """end of block starting with <, same on any level:
          >
         """
@@ -141,30 +149,41 @@ class RppFile:
         elif self.in_track:
             self.in_track = False
 
-    def read(self):
+    @shared.instrumented
+    def read(self, progress=None):
         """read the file into internal structures
-        using the preceding methods/callbacks"""
+        using the preceding methods/callbacks
+
+        progress, if given, is called with a description of each track before reading it
+        and before dividing it into patterns; it can stop the reading by raising an exception
+        """
         self.in_track = self.in_pattern = self.in_source = False
         self.instrument_number = 0
         with open(self.filename) as _in:
-            for line in _in:
-                line = line.strip()
-                try:
-                    linetype, data = line.split(None, 1)
-                except ValueError:
-                    linetype = line
-                if linetype in self.procs:
-                    self.procs[linetype](data)
-        with open('/tmp/rpp_patterns', 'w') as _o:
-            pprint.pprint(self.pattern_list, stream=_o)
-            pprint.pprint(self.patterns, stream=_o)
+            text = _in.read()
+        for match in tokens.finditer(text):
+            tick, evtype, channel, pitch, velocity, linetype, data = match.groups()
+            if linetype == '<TRACK' and progress:
+                progress(f'reading track {self.instrument_number + 1}')
+            if linetype:
+                self.procs[linetype](data or '')
+            else:
+                self.process_event(int(tick), evtype, channel, int(pitch, base=16), velocity)
+        trace = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if trace:
+            with open('/tmp/rpp_patterns', 'w') as _o:
+                pprint.pprint(self.pattern_list, stream=_o)
+                pprint.pprint(self.patterns, stream=_o)
 
         self.old_patterns = self.patterns
         self.old_pattern_list = self.pattern_list
         new_patterns = collections.defaultdict(list)
         new_pattern_list = collections.defaultdict(list)
-        pattstarts = collections.defaultdict(set)
+        # per track: the last window (of shared.per_line events) used from each pattern start
+        pattstarts = collections.defaultdict(dict)
         for track, pattern_start_list in self.pattern_list.items():
+            if progress:
+                progress(f'dividing track {track} into patterns')
             new_patterns_temp = []
             new_pattern_list_temp = {}
             pattix = 0
@@ -176,10 +195,14 @@ class RppFile:
                 oldpattnum, oldpattstart = item[:2]
                 abspattstart += oldpattstart
                 oldpattnum2, oldpattprops, oldpattdata = self.patterns[track][pattix]
-                log(f"{oldpattnum} {oldpattnum2} {abspattstart}")
+                if trace:
+                    logging.debug(f"{oldpattnum} {oldpattnum2} {abspattstart}")
                 if oldpattnum2 > oldpattnum or not oldpattdata:
                     continue    # no data for pattern (just event c0 after event c0)
                 if oldpattnum2 != oldpattnum:     # should never happen
+                    if not trace:
+                        raise ValueError(f'mismatch on track {track} pattern {oldpattnum} met'
+                                         f' pattern {oldpattnum2}')
                     with open('/tmp/rpp_patterns', 'w') as _o:
                         pprint.pprint(self.patterns, stream=_o)
                     with open('/tmp/rpp_pattern_list', 'w') as _o:
@@ -188,25 +211,18 @@ class RppFile:
                                      f' pattern {oldpattnum2}, data dumped to /tmp')
                 newpattdata = collections.defaultdict(dict)
                 for pitch, events in oldpattdata.items():
-                    ## newpattnum = 0
-                    low_event = 0
-                    highest = max(events) + shared.per_line
-                    high_event = low_event + shared.per_line
-
-                    ## pattstarts.add((low_event, high_event))
-                    pattstarts[track].add(
-                        (low_event + abspattstart, high_event + abspattstart))
-                    while high_event <= highest:
-                        new_events = [x - low_event for x in events
-                                      if low_event <= x < high_event]
-                        if new_events:
-                            newpattstart = oldpattstart + low_event
-                            newpattdata[newpattstart][pitch] = new_events
-                        low_event = high_event
-                        high_event += shared.per_line
-                        ## pattstarts.add((low_event, high_event))
-                        pattstarts[track].add(
-                            (low_event + abspattstart, high_event + abspattstart))
+                    # put the events in their windows in one go
+                    windows = collections.defaultdict(list)
+                    for event in events:
+                        windows[event // shared.per_line].append(event)
+                    for window, new_events in windows.items():
+                        low_event = window * shared.per_line
+                        newpattstart = oldpattstart + low_event
+                        newpattdata[newpattstart][pitch] = [x - low_event for x in new_events]
+                    # the window after the last one containing events also gets a start
+                    last_window = max(events) // shared.per_line + 1
+                    if last_window > pattstarts[track].get(abspattstart, -1):
+                        pattstarts[track][abspattstart] = last_window
                 ## pdb.set_trace()
                 pattnum = 0
                 for pattstart, pattdata in sorted(newpattdata.items()):
@@ -216,26 +232,24 @@ class RppFile:
 
                 pattix += 1
 
-            previous_patterns = []
-            newnum = 0
+            previous_patterns = shared.PatternIndex()
             for item in new_patterns_temp:
                 patt, props, data = item
                 start = new_pattern_list_temp[patt]
                 if not data:
                     continue
-                try:
-                    num_ = previous_patterns.index(data) + 1
-                except ValueError:
-                    previous_patterns.append(data)
-                    newnum += 1
-                    num_ = newnum
+                num_, is_new = previous_patterns.add(data)
+                if is_new:
                     new_patterns[track].append((num_, props, data))
                 new_pattern_list[track].append((start, num_))
 
         self.pattstarts = {}
         for track, starts in pattstarts.items():
             ## self.pattstarts[track] = [(x, y - x) for x, y in sorted(starts)]
-            self.pattstarts[track] = sorted(starts)
+            windows = heapq.merge(*(range(start, start + (last + 1) * shared.per_line,
+                                          shared.per_line) for start, last in starts.items()))
+            self.pattstarts[track] = [(x, x + shared.per_line)
+                                      for x, _ in itertools.groupby(windows)]
         ## pdb.set_trace()
         # TODO hier moet ik verder gaan opknippen om de pattern starts
         # voor de verschillende tracks in overeenstemming met elkaar te brengen
@@ -255,14 +269,27 @@ class RppFile:
         self.instruments = {x: y for x, y in self.instruments.items() if x in
                             self.pattern_list}
 
-    def process(self, gui):
+    def get_instrument_lists(self):
+        """return the names of the regular instruments and the drum tracks found in the file
+
+        drum tracks that are recognizable as such are returned with their letter(s) attached
+        """
+        nondrums = [y for x, y in self.instruments.items()
+                    if not self.patterns[x][0][1]['drumtrack']]
+        drums = [y + ' (*)' for x, y in self.instruments.items()
+                 if self.patterns[x][0][1]['drumtrack']]
+        return nondrums, drums
+
+    def process(self, options):
         """Create output for Reaper project
 
         this is assuming I only have projects that use MIDI data
         where drums are in a separate track instead of one drum per track
         """
-        with open(gui.get_general_filename(), 'w') as _out:
-            self.print_general_data(gui.show_continual, _out)
+        self.short_format = options.short_format
+        self.show_continual = options.full
+        with options.open_output(options.names.get_general_filename(), 'w') as _out:
+            self.print_general_data(self.show_continual, _out)
         # kijken of er dubbele namen zijn
         test, dubbel = set(), set()
         # for trackno, data in self.instruments.items():
@@ -272,21 +299,20 @@ class RppFile:
             else:
                 test.add(data)
         self.prepare_print_instruments()
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
-        if gui.check_allinone.isChecked():
-            inst_list = gui.list_items(gui.list_samples)
-            inst_list += [x.rsplit(' ', 1)[0] for x in gui.list_items(gui.mark_samples)]
-            with open(gui.get_general_filename(), 'a') as _out:
-                self.print_all_instruments_full(inst_list, options, _out)
+        opts = (options.max_events, options.crop_empty)
+        if options.all_in_one:
+            inst_list = options.instruments + options.drumsamples
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
+                self.print_all_instruments_full(inst_list, opts, _out)
             return []
         all_unlettered = []
         for trackno, data in self.instruments.items():
             name = data
             if name in dubbel:
                 name += '-' + str(trackno)
-            with open(gui.get_instrument_filename(name), 'w') as _out:
-                if gui.check_full.isChecked():
-                    self.print_instrument_full(trackno, options, _out)
+            with options.open_output(options.names.get_instrument_filename(name), 'w') as _out:
+                if options.full:
+                    self.print_instrument_full(trackno, opts, _out)
                     unlettered = []
                 else:
                     unlettered = self.print_instrument(trackno, _out)
@@ -294,6 +320,7 @@ class RppFile:
                 all_unlettered.append(f'track {trackno}: {line}')
         return all_unlettered
 
+    @shared.instrumented
     def print_general_data(self, full=False, stream=sys.stdout):
         """create the "overview" file (sample and pattern lists)
         """
@@ -308,6 +335,7 @@ class RppFile:
         for line in data:
             print(line.rstrip(), file=stream)
 
+    @shared.instrumented
     def print_instrument(self, trackno, stream=sys.stdout):
         """print the events for an instrument as a piano roll
 
@@ -319,28 +347,36 @@ class RppFile:
         for patt_no, props, patt_data in self.patterns[trackno]:
             data.append(shared.patt_start.format(patt_no))
             is_drumtrack = props['drumtrack']
+            empty_event = shared.empty[is_drumtrack]
             printables = collections.defaultdict(list)
-            for key, note_events in patt_data.items():
+            for pitch, note_events in patt_data.items():
                 seqnum = 0
                 events = []
                 if is_drumtrack:
-                    notestr = shared.get_inst_name(key + shared.note2drums)
+                    notestr = shared.drum_letters[pitch]
                     if notestr == '?':
-                        name = shared.gm_drums[key + shared.note2drums][1]
+                        name = shared.gm_drums[pitch + shared.note2drums][1]
                         unlettered.add(f'no letter yet for `{name}`')
+                        key = -1
+                    elif shared.drum_positions[pitch] < 0:
+                        unlettered.add(f'{notestr} not in standard printseq'
+                                       f' {shared.standard_printseq}')
+                        key = -1
                     else:
-                        key = shared.standard_printseq.index(notestr)
+                        key = shared.drum_positions[pitch]
                 else:
-                    notestr = shared.get_note_name(key)     # (was - 12)
+                    notestr = shared.note_names[pitch]     # (was - 12)
+                    key = pitch
                 factor = shared.tick_factor
+                empty_events = factor * [empty_event]
                 for i in range(factor * (note_events[-1] // factor + 1)):
                     if i in note_events:
                         events.append(notestr)
                     else:
-                        events.append(shared.empty[is_drumtrack])
+                        events.append(empty_event)
                     if (i + 1) % factor == 0:
                         seqnum += 1
-                        if events != factor * [shared.empty[is_drumtrack]]:
+                        if events != empty_events:
                             delim = shared.sep[is_drumtrack]
                             printables[seqnum].append((key, delim.join(events)))
                         events = []
@@ -354,13 +390,14 @@ class RppFile:
             print(line, file=stream)
         return unlettered
 
+    @shared.instrumented
     def prepare_print_instruments(self):
         """build complete timeline for (drum and regular) instrument events
         """
-        self.all_note_tracks = collections.defaultdict(
-            lambda: collections.defaultdict(list))
+        self.all_note_tracks = collections.defaultdict(dict)
         self.unlettered = set()
         self.all_notes = collections.defaultdict(set)
+        self.note_order = {}
         # volgens mij moet ik hier weer uitgaan van de oldpatterns om daaruit een volledig track
         # op te bouwen
         # pattern lengtes zijn inmiddels toegevoegd in oldpatternlist, die kan ik gebruiken voor de
@@ -397,10 +434,12 @@ class RppFile:
             # fill al the gaps between patterns beforehand
             for note in self.all_notes[trackno]:
                 if is_drumtrack:
-                    notestr = shared.get_inst_name(note + shared.note2drums)
-                    self.all_note_tracks[trackno][notestr] = self.total_length * [empty_event]
+                    notestr = shared.drum_letters[note]
+                    self.all_note_tracks[trackno][notestr] = shared.Timeline(
+                        notestr, empty_event, self.total_length)
                 else:
-                    self.all_note_tracks[trackno][note] = self.total_length * [empty_event]
+                    self.all_note_tracks[trackno][note] = shared.Timeline(
+                        shared.note_names[note], empty_event, self.total_length)
 
             # fill in the separate events
             for item in self.old_pattern_list[trackno]:
@@ -409,12 +448,12 @@ class RppFile:
                 pattnum, pattstart = item[:2]
                 for note in self.all_notes[trackno]:
                     if is_drumtrack:
-                        notestr = shared.get_inst_name(note + shared.note2drums)
+                        notestr = shared.drum_letters[note]
                         if notestr == '?':
                             name = shared.gm_drums[note + shared.note2drums][1]
                             self.unlettered.add(f'no letter yet for `{name}`')
                     else:
-                        notestr = shared.get_note_name(note)
+                        notestr = shared.note_names[note]
                     if note not in pattdict[pattnum]:
                         continue
                     for event in pattdict[pattnum][note]:
@@ -426,8 +465,15 @@ class RppFile:
                         #     ix, len(self.all_note_tracks[trackno][ix]), event))
                         # if evt == len(self.all_note_tracks[trackno][ix]):
                         #     for ix2 in self.all_note_tracks[trackno]
-                        self.all_note_tracks[trackno][ix][event] = notestr
+                        self.all_note_tracks[trackno][ix].set(event)
+
+            if is_drumtrack:
+                self.note_order[trackno] = [x for x in shared.standard_printseq
+                                            if x in self.all_note_tracks[trackno]]
+            else:
+                self.note_order[trackno] = sorted(self.all_notes[trackno], reverse=True)
 
+    @shared.instrumented
     def print_instrument_full(self, trackno, opts, stream=sys.stdout):
         """output an instrument timeline to a separate file/stream
 
@@ -436,37 +482,16 @@ class RppFile:
         """
         interval, clear_empty = opts
         is_drumtrack = self.patterns[trackno][0][1]['drumtrack']
-        empty_event = shared.empty[is_drumtrack]
         if is_drumtrack and self.short_format:
             interval *= 2
 
         full_length = self.total_length
-        empty = shared.sep[is_drumtrack].join(interval * [empty_event])
-
-        if is_drumtrack:
-            all_notes = [x for x in shared.standard_printseq if x in self.all_note_tracks[trackno]]
-        else:
-            all_notes = list(reversed(sorted(self.all_notes[trackno])))
         delim = shared.eventsep(is_drumtrack, self.short_format)
-        for eventindex in range(0, full_length, interval):
-            if eventindex + interval > full_length:
-                empty = delim.join((full_length - eventindex) * [empty_event])
-            not_printed = True
-            for note in all_notes:
-                note_data = self.all_note_tracks[trackno][note]
-                if is_drumtrack:
-                    line = delim.join(list(note_data[eventindex:eventindex + interval]))
-                else:
-                    line = delim.join(note_data[eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print(line, file=stream)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty[is_drumtrack], file=stream)
-            print('', file=stream)
+        tracks = [self.all_note_tracks[trackno][x] for x in self.note_order[trackno]]
+        for lines in shared.iter_lines(tracks, full_length, interval, delim, clear_empty):
+            shared.print_lines(lines, shared.empty[is_drumtrack], stream)
 
+    @shared.instrumented
     def print_all_instruments_full(self, instlist, opts, stream=sys.stdout):
         """output all instrument timelines to the "general" file
 
@@ -476,6 +501,7 @@ class RppFile:
         interval, clear_empty = opts
         inst2sam = {y: x for x, y in self.instruments.items()}
         full_length = self.total_length
+        trace = logging.getLogger().isEnabledFor(logging.DEBUG)
         for eventindex in range(0, full_length, interval):
             for instname in instlist:
                 trackno = inst2sam[instname]
@@ -486,24 +512,16 @@ class RppFile:
                 else:
                     print(f'{instname}:', file=stream)
                 delim = shared.eventsep(is_drumtrack, self.short_format)
-                empty = delim.join(interval * [empty_event])
-                if eventindex + interval > full_length:
-                    empty = delim.join((full_length - eventindex) * [empty_event])
-                if is_drumtrack:
-                    all_notes = [x for x in shared.standard_printseq
-                                 if x in self.all_note_tracks[trackno]]
-                else:
-                    all_notes = list(reversed(sorted(self.all_notes[trackno])))
                 not_printed = True
-                for note in all_notes:
-                    line = delim.join(self.all_note_tracks[trackno][note]
-                                      [eventindex:eventindex + interval])
-                    log(f'note {note} line: {line}')
-                    if clear_empty and (line == empty or not line):
-                        pass
-                    else:
-                        print('  ', line, file=stream)
-                        not_printed = False
+                for note in self.note_order[trackno]:
+                    track = self.all_note_tracks[trackno][note]
+                    if clear_empty and not track.has_events(eventindex, eventindex + interval):
+                        continue
+                    line = track.render(eventindex, eventindex + interval, delim)
+                    if trace:
+                        logging.debug(f'note {note} line: {line}')
+                    print('  ', line, file=stream)
+                    not_printed = False
                 if not_printed:
                     print('  ', empty_event, file=stream)
                 print('', file=stream)
@@ -1,12 +1,24 @@
 """shared stuff for ModReader data processing modules
 """
 ## import os.path
+import os
+import sys
+import io
 import pathlib
+import bisect
+import contextlib
+import collections
+import collections.abc
 import configparser
+import dataclasses
 import logging
-
-logging.basicConfig(filename='/tmp/modreader.log', level=logging.DEBUG,
-                    format='%(asctime)s %(module)s %(message)s')
+import logging.handlers
+import queue
+import atexit
+import time
+import functools
+import contextvars
+import tracemalloc
 
 
 def log(inp):
@@ -26,6 +38,11 @@ for item in options['general']['known_files'].split():
     known_files.extend([item, item.upper()])
 basedir = pathlib.Path(options['general']['basedir']).expanduser()
 location = pathlib.Path(options['general']['location']).expanduser()
+cachedir = options['general'].get('cachedir', '~/.cache/modreader')
+cachedir = pathlib.Path(cachedir).expanduser() if cachedir else None
+loglevel = os.environ.get('MODREADER_LOGLEVEL') or options['general'].get('loglevel', 'WARNING')
+logfile = os.environ.get('MODREADER_LOGFILE') or options['general'].get('logfile',
+                                                                        '/tmp/modreader.log')
 notenames = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 max_lines = per_line = 32
 octave_length = 12
@@ -42,6 +59,282 @@ empty_drums = '.'
 sep_long = '   '
 sep = {True: '', False: ' '}
 empty = {True: empty_drums, False: empty_note}
+# lookup tables by midi pitch, so these don't have to be worked out again for every event
+midi_pitches = range(128)
+note_names = tuple(notenames[x % octave_length].ljust(2) + str(x // octave_length)
+                   for x in midi_pitches)
+note_numbers = {x: y for y, x in enumerate(note_names)}
+# LMMS keys are an octave lower than midi pitches and go up to 119, so the drum tables
+# also cover those keys shifted up an octave
+drum_keys = range(len(midi_pitches) + octave_length)
+drum_letters = tuple(gm_drums[x + note2drums][0]
+                     if -len(gm_drums) <= x + note2drums < len(gm_drums) else ' '
+                     for x in drum_keys)
+# position in the top-to-bottom drum sequence, -1 if the letter isn't in it (like str.find)
+drum_positions = tuple(standard_printseq.find(x) if x.strip() else -1 for x in drum_letters)
+log_listener = None
+
+
+def setup_logging(logqueue=None):
+    """start logging at the configured level to the configured file
+
+    these are the `loglevel` and `logfile` settings in the config file, which can be overridden
+    with the MODREADER_LOGLEVEL and MODREADER_LOGFILE environment variables
+    messages are only put in a queue by the thread doing the logging, a listener thread writes
+    them to the file; pass a multiprocessing queue to also use it for worker processes
+    """
+    global log_listener
+    if log_listener is not None:
+        return log_listener
+    if logqueue is None:
+        logqueue = queue.SimpleQueue()
+    handler = logging.FileHandler(logfile, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(module)s %(message)s'))
+    log_listener = logging.handlers.QueueListener(logqueue, handler)
+    setup_worker_logging(logqueue)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    return log_listener
+
+
+def setup_worker_logging(logqueue):
+    """let a worker process send its log messages to the main process's listener
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(logqueue))
+    root.setLevel(loglevel.upper())
+
+
+current_instrumentation = contextvars.ContextVar('current_instrumentation', default=None)
+# what the reader is doing, recognized by the start of the method names
+phase_prefixes = (('read', 'read'), ('dedup', 'remove_duplicate_'),
+                  ('prepare', 'prepare_print_'), ('print', 'print_'))
+
+
+def get_phase(name):
+    """return the phase of the work a reader method belongs to
+    """
+    for phase, prefix in phase_prefixes:
+        if name.startswith(prefix):
+            return phase
+    return name
+
+
+class Instrumentation:
+    """wall time, cpu time and peak memory used per reader method, see instrumentation()
+
+    time spent in an instrumented method called from another one is not counted for the
+    caller; the peak memory is only known if allocations are traced
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stats = {}
+        self.stack = []
+        self.started = 0.0, 0.0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        "record what happens in the with block under the given name"
+        self.switch()
+        if name not in self.stats:
+            self.stats[name] = {'phase': get_phase(name), 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                'peak': 0 if self.trace_memory else None}
+        self.stats[name]['calls'] += 1
+        self.stack.append((name, tracemalloc.get_traced_memory()[0] if self.trace_memory else 0))
+        try:
+            yield
+        finally:
+            self.switch()
+            self.stack.pop()
+
+    def switch(self):
+        "charge what was used since the last switch to the method that was running"
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self.stack:
+            name, base = self.stack[-1]
+            stats = self.stats[name]
+            stats['wall'] += wall - self.started[0]
+            stats['cpu'] += cpu - self.started[1]
+            if self.trace_memory:
+                stats['peak'] = max(stats['peak'], tracemalloc.get_traced_memory()[1] - base)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.started = wall, cpu
+
+    def report(self):
+        """return the figures per method name: phase, number of calls, wall and cpu time in
+        seconds and peak memory in bytes
+        """
+        return {x: dict(y) for x, y in self.stats.items()}
+
+
+@contextlib.contextmanager
+def instrumentation(trace_memory=False):
+    """record the work done by the readers' instrumented methods within the with block
+
+    yields an Instrumentation object to get the report from; this only applies to the
+    current thread, so e.g. loading files in the background isn't mixed in
+    with trace_memory set allocations are traced, which makes everything a lot slower
+    """
+    recorder = Instrumentation(trace_memory)
+    token = current_instrumentation.set(recorder)
+    start_tracing = trace_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    try:
+        yield recorder
+    finally:
+        current_instrumentation.reset(token)
+        if start_tracing:
+            tracemalloc.stop()
+
+
+def instrumented(method):
+    """decorator to have calls of a reader method recorded when instrumentation is active
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        recorder = current_instrumentation.get()
+        if recorder is None:
+            return method(*args, **kwargs)
+        with recorder.phase(method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def merge_reports(reports):
+    """add up instrumentation reports, e.g. for all the files in a batch
+    """
+    result = {}
+    for report in reports:
+        for name, stats in report.items():
+            if name not in result:
+                result[name] = dict(stats)
+                continue
+            total = result[name]
+            for key in ('calls', 'wall', 'cpu'):
+                total[key] += stats[key]
+            if stats['peak'] is not None:
+                total['peak'] = max(total['peak'] or 0, stats['peak'])
+    return result
+
+
+def format_report(report):
+    """return an instrumentation report as lines of text, grouped by phase
+    """
+    traced = any(x['peak'] is not None for x in report.values())
+    lines = [f"{'':32} {'calls':>6} {'wall (s)':>9} {'cpu (s)':>9}"
+             + (f" {'peak (kB)':>9}" if traced else '')]
+    phases = [x for x, _ in phase_prefixes]
+    phases += sorted({x['phase'] for x in report.values()} - set(phases))
+    for phase in phases:
+        names = sorted(x for x, y in report.items() if y['phase'] == phase)
+        if not names:
+            continue
+        for name in names:
+            stats = report[name]
+            line = f"{name:32} {stats['calls']:6} {stats['wall']:9.3f} {stats['cpu']:9.3f}"
+            if traced:
+                line += f" {stats['peak'] // 1024 if stats['peak'] is not None else '':>9}"
+            lines.append(line)
+        lines.append(f"{'(' + phase + ')':32} {'':6}"
+                     f" {sum(report[x]['wall'] for x in names):9.3f}"
+                     f" {sum(report[x]['cpu'] for x in names):9.3f}")
+    return lines
+
+
+class OutputNames:
+    """naming strategy for the transcription files of a module
+
+    the default puts them all in one directory, prefixed with a date/time stamp and the
+    file type; subclass and override get_instrument_filename to name them differently
+    """
+    def __init__(self, destdir, stamp, ftype):
+        self.destdir = str(destdir)
+        self.stamp = stamp
+        self.ftype = ftype
+
+    def get_general_filename(self):
+        """determine filename for overview file
+        """
+        return self.get_instrument_filename('general')
+
+    def get_drums_filename(self):
+        """determine filename for drum instrument file
+        """
+        return self.get_instrument_filename('drums')
+
+    def get_instrument_filename(self, name):
+        """determine filename for "regular" instrument file
+        """
+        return str(pathlib.Path(self.destdir) / f'{self.stamp}-{self.ftype}-{name}')
+
+
+@dataclasses.dataclass
+class TranscriptionOptions:
+    """what to transcribe and how, as chosen on the main screen
+
+    instruments: the regular instruments, in the order they should be printed
+    drumsamples, letters: the drum instruments and the letter(s) assigned to each
+    printseq: the top-to-bottom sequence of the drum letters
+    names: where to write the output (an OutputNames instance)
+    progress: optional callback that gets told which file is being written
+    the remaining fields are the transcription options
+    """
+    instruments: list = dataclasses.field(default_factory=list)
+    drumsamples: list = dataclasses.field(default_factory=list)
+    letters: list = dataclasses.field(default_factory=list)
+    printseq: str = ''
+    max_events: int = 32
+    full: bool = False
+    crop_empty: bool = False
+    all_in_one: bool = False
+    short_format: bool = True
+    names: OutputNames = None
+    atomic_write: bool = False
+    progress: collections.abc.Callable = None
+
+    def open_output(self, filename, mode='w'):
+        """open a transcription file for writing, see buffered_output
+
+        if a progress callback is set it is called with the name of the file first
+        """
+        if self.progress:
+            self.progress(f'writing {pathlib.Path(filename).name}')
+        return buffered_output(filename, mode, self.atomic_write)
+
+
+@contextlib.contextmanager
+def buffered_output(filename, mode='w', atomic=False):
+    """collect everything printed to the returned stream and write it to the file in one go
+
+    with atomic set the text is written to a temporary file next to the target and then
+    renamed, so readers of the file never see a half written transcription; otherwise
+    whatever was printed before an error still ends up in the file, like with open()
+    """
+    buffer = io.StringIO()
+    if not atomic:
+        try:
+            yield buffer
+        finally:
+            with open(filename, mode) as _out:
+                _out.write(buffer.getvalue())
+        return
+    yield buffer
+    text = buffer.getvalue()
+    path = pathlib.Path(filename)
+    if mode == 'a' and path.exists():
+        text = path.read_text() + text
+    temp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(temp, 'w') as _out:
+            _out.write(text)
+        os.replace(temp, path)
+    finally:
+        if temp.exists():
+            temp.unlink()
 
 
 def eventsep(is_drumtrack, short_format):
@@ -54,6 +347,8 @@ def eventsep(is_drumtrack, short_format):
 def get_note_name(inp):
     """translate note number to note name
     """
+    if 0 <= inp < len(note_names):
+        return note_names[inp]
     octave, noteval = divmod(inp, octave_length)
     return notenames[noteval].ljust(2) + str(octave)
 
@@ -61,6 +356,8 @@ def get_note_name(inp):
 def getnotenum(x):
     """translate note name to note number
     """
+    if x in note_numbers:
+        return note_numbers[x]
     octave = octave_length * int(x[2])
     seq = notenames.index(x[:2].strip())
     return octave + seq
@@ -76,6 +373,354 @@ def get_inst_name(inp):
         return ' '
 
 
+def pattern_key(patt):
+    """return a hashable equivalent of a (nested) pattern structure
+
+    two patterns compare equal exactly when their keys do
+    """
+    if isinstance(patt, dict):
+        return frozenset((key, pattern_key(value)) for key, value in patt.items())
+    if isinstance(patt, (list, tuple)):
+        return tuple(pattern_key(item) for item in patt)
+    return patt
+
+
+class PatternIndex:
+    """collection of unique patterns, numbered from 1 in order of appearance
+
+    replaces looking up a pattern with list.index, using a dictionary on the pattern keys
+    """
+    def __init__(self):
+        self.patterns = []
+        self._numbers = {}
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, patt):
+        """return the number of the pattern and whether it wasn't seen before
+        """
+        key = pattern_key(patt)
+        try:
+            return self._numbers[key], False
+        except KeyError:
+            self.patterns.append(patt)
+            self._numbers[key] = len(self.patterns)
+            return len(self.patterns), True
+
+
+class Timeline:
+    """the events for one note (or drum instrument) over the whole of a song
+
+    instead of the text for every tick this holds one byte per tick telling whether the note
+    is played there; the text is only produced when printing
+    label is the text to show for an event, empty the text to show for no event
+    """
+    def __init__(self, label, empty, length=0):
+        self.label = label
+        self.empty = empty
+        self.ticks = bytearray(length)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def extend(self, length, events=()):
+        """add a stretch of ticks, with events on the given positions within it
+
+        positions outside of the stretch are ignored
+        """
+        start = len(self.ticks)
+        self.ticks.extend(bytes(length))
+        for tick in events:
+            if 0 <= tick < length:
+                self.ticks[start + tick] = 1
+
+    def set(self, tick):
+        """add an event on the given (absolute) position
+        """
+        self.ticks[tick] = 1
+
+    def has_events(self, start, stop):
+        """tell whether any of the ticks in the given range contains an event
+        """
+        return self.ticks.find(1, start, stop) != -1
+
+    def render(self, start, stop, sep):
+        """return the printable text for the given range of ticks
+        """
+        texts = (self.empty, self.label)
+        return sep.join([texts[x] for x in self.ticks[start:stop]])
+
+
+class PatternTimeline:
+    """a timeline that is built from patterns, rendered only when asked for
+
+    it has the same interface as Timeline (except for setting single events), but instead
+    of a byte per tick it keeps the start of each pattern played, together with the
+    pattern's length and events; repeated patterns are stored only once
+    """
+    def __init__(self, label, empty):
+        self.label = label
+        self.empty = empty
+        self.length = 0
+        self.starts = []
+        self.patterns = []
+        self._seen = {}
+
+    def __len__(self):
+        return self.length
+
+    def extend(self, length, events=()):
+        """add a pattern of the given length, with events on the given positions within it
+
+        positions outside of the pattern are ignored
+        """
+        key = (length, tuple(events))
+        try:
+            pattern = self._seen[key]
+        except KeyError:
+            pattern = (length, frozenset(x for x in events if 0 <= x < length))
+            self._seen[key] = pattern
+        self.starts.append(self.length)
+        self.patterns.append(pattern)
+        self.length += length
+
+    def overlapping(self, start, stop):
+        """generate the events of the patterns that overlap the given range of ticks,
+        each with the range of the pattern's ticks that lies within it
+        """
+        ix = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        while ix < len(self.starts) and self.starts[ix] < stop:
+            offset = self.starts[ix]
+            length, events = self.patterns[ix]
+            yield events, range(max(start - offset, 0), min(stop - offset, length))
+            ix += 1
+
+    def has_events(self, start, stop):
+        """tell whether any of the ticks in the given range contains an event
+        """
+        return any(ticks.start <= x < ticks.stop
+                   for events, ticks in self.overlapping(start, stop) for x in events)
+
+    def render(self, start, stop, sep):
+        """return the printable text for the given range of ticks
+        """
+        texts = []
+        for events, ticks in self.overlapping(start, stop):
+            texts.extend(self.label if x in events else self.empty for x in ticks)
+        return sep.join(texts)
+
+
+def iter_lines(timelines, total_length, interval, sep, clear_empty=False):
+    """generate the printable lines for a number of timelines, one stretch of `interval`
+    ticks at a time
+
+    yields a list with a line per timeline, leaving out the ones without events in the
+    stretch if clear_empty is set
+    """
+    for start in range(0, total_length, interval):
+        stop = start + interval
+        yield [x.render(start, stop, sep) for x in timelines
+               if not clear_empty or x.has_events(start, stop)]
+
+
+def print_lines(lines, empty, stream, indent=''):
+    """print the lines for one stretch of a timeline followed by an empty line,
+    or the text for "no events" if there aren't any
+    """
+    prefix = (indent,) if indent else ()
+    for line in lines or [empty]:
+        print(*prefix, line, file=stream)
+    print('', file=stream)
+
+
+class TrackerModule:
+    """processing shared by the readers for tracker modules (mod, med, xm)
+
+    the readers bring their patterns into a common form:
+    pattern_data maps a sample number (or 'drums') to the list of its unique patterns,
+    playseqs maps it to the numbers (starting at 1) of these patterns in play order, with -1
+    for where the sample doesn't play, and play_lengths holds the length of each position in
+    the play order
+    for building the timelines a pattern is a mapping of note (or drum letter) to the ticks it
+    is played on, with the pattern length under 'len'; readers that store their patterns
+    differently override get_note_patterns and get_drum_patterns
+    """
+    short_format = True
+
+    def renumber_patterns(self, key, patterns, playseq):
+        """show patterns only once for incontiguous timelines
+
+        patterns holds (pattern number, pattern) pairs, playseq the pattern numbers in play order
+        """
+        renumber = {}
+        pattern_index = PatternIndex()
+        for pattnum, patt in patterns:
+            renumber[pattnum] = pattern_index.add(patt)[0]
+        self.pattern_data[key] = pattern_index.patterns
+        self.playseqs[key] = [renumber.get(x, -1) for x in playseq]
+
+    def merge_drum_patterns(self, events, samp2lett):
+        """combine the patterns of the drum samples into patterns per drum letter
+
+        events maps pattern numbers to the patterns per sample number, samp2lett maps sample
+        numbers to the letter(s) to print for them; the events of samples with more than one
+        letter are added to the tracks for each of these letters
+        """
+        drumpatterns = collections.defaultdict(lambda: collections.defaultdict(list))
+        for pattnum, data in events.items():
+            for sampnum, patt in data.items():
+                letters = samp2lett.get(sampnum, '')
+                if len(letters) != 1:
+                    continue
+                drumpatterns[pattnum]['len'].append((letters, patt['len']))
+                # theoretisch kan dit data voor meer toonhoogten bevatten
+                # maar voor mijn spullen kan ik uitgaan van één
+                drumpatterns[pattnum][letters] = list([y for x, y in patt.items()
+                                                       if x != 'len'][0])
+        for pattnum, data in events.items():
+            for sampnum, patt in data.items():
+                letters = samp2lett.get(sampnum, '')
+                if len(letters) < 2:
+                    continue
+                ticks = [y for x, y in patt.items() if x != 'len'][0]
+                for letter in letters:
+                    drumpatterns[pattnum]['len'].append((letter, patt['len']))
+                    drumpatterns[pattnum][letter].extend(ticks)
+                    drumpatterns[pattnum][letter].sort()
+        for pattnum, patt in drumpatterns.items():
+            lengths = [x[1] for x in patt['len']]
+            if max(lengths) != lengths[0] or min(lengths) != lengths[0]:
+                print(f'ongelijke lengtes in pattern {pattnum}: {lengths}')
+            patt['len'] = lengths[0]
+        return drumpatterns
+
+    def get_instrument_lists(self):
+        """return the names of the regular instruments and the drum tracks found in the file
+
+        drum tracks that are recognizable as such are returned with their letter(s) attached
+        """
+        return [x[1] for x in self.samplenames], []
+
+    def get_note_label(self, note):
+        """return the text to show for a note in the timelines
+        """
+        return str(note)
+
+    def get_note_order(self, note):
+        """return the key to sort the notes of an instrument on (printed highest first)
+        """
+        return note
+
+    def get_note_patterns(self, sample):
+        """return the unique patterns for a regular instrument
+        """
+        return self.pattern_data[sample]
+
+    def get_drum_patterns(self):
+        """return the unique patterns for the drums
+        """
+        return self.pattern_data.get('drums', [])
+
+    @instrumented
+    def prepare_print_drums(self, printseq):
+        """build complete timeline for drum instrument events
+
+        printseq indicates the top-to-bottom sequence of instruments
+        """
+        self.all_drum_tracks = {x: PatternTimeline(x, empty_drums) for x in printseq}
+        patterns = self.get_drum_patterns()
+        for pattseq, pattnum in enumerate(self.playseqs['drums']):
+            if pattnum == -1:
+                for track in self.all_drum_tracks.values():
+                    track.extend(self.play_lengths[pattseq])
+                continue
+            pattern = patterns[pattnum - 1]
+            for inst, track in self.all_drum_tracks.items():
+                track.extend(pattern['len'], pattern.get(inst, ()))
+
+    @instrumented
+    def prepare_print_instruments(self, samplist):
+        """build complete timeline for all regular instrument events
+
+        samplist holds (number, name) pairs for the instruments
+        """
+        self.all_note_tracks = collections.defaultdict(dict)
+        self.all_notes = collections.defaultdict(list)
+        for sample, _ in samplist:
+            patterns = self.get_note_patterns(sample)
+            notes = set()
+            for pattern in patterns:
+                notes.update(pattern)
+            notes.discard('len')
+            notes = list(reversed(sorted(notes, key=self.get_note_order)))
+            tracks = {x: PatternTimeline(self.get_note_label(x), empty_note) for x in notes}
+            for pattseq, pattnum in enumerate(self.playseqs[sample]):
+                if pattnum == -1:
+                    for track in tracks.values():
+                        track.extend(self.play_lengths[pattseq])
+                    continue
+                pattern = patterns[pattnum - 1]
+                for note, track in tracks.items():
+                    track.extend(pattern['len'], pattern.get(note, ()))
+            self.all_notes[sample] = notes
+            self.all_note_tracks[sample] = tracks
+
+    @instrumented
+    def print_drums_full(self, printseq, opts, _out=sys.stdout):
+        """output the drums timeline to a separate file/stream
+
+        printseq indicates the top-to-bottom sequence of instruments
+        opts indicates how many events per line and whether to print "empty" lines
+        """
+        interval, clear_empty = opts
+        if self.short_format:
+            interval *= 2
+        tracks = [self.all_drum_tracks[x] for x in printseq]
+        for lines in iter_lines(tracks, sum(self.play_lengths), interval,
+                                eventsep(True, self.short_format), clear_empty):
+            print_lines(lines, empty_drums, _out)
+
+    @instrumented
+    def print_instrument_full(self, sample, opts, _out=sys.stdout):
+        """output an instrument timeline to a separate file/stream
+
+        sample indicates the instrument to process
+        opts indicates how many events per line and whether to print "empty" lines
+        """
+        total_length = sum(self.play_lengths)
+        interval, clear_empty = opts
+        if interval == -1:
+            interval = total_length
+        tracks = [self.all_note_tracks[sample][x] for x in self.all_notes[sample]]
+        for lines in iter_lines(tracks, total_length, interval,
+                                eventsep(False, self.short_format), clear_empty):
+            print_lines(lines, empty_note, _out)
+
+    @instrumented
+    def print_all_instruments_full(self, instlist, printseq, opts, _out=sys.stdout):
+        """output all instrument timelines to the "general" file
+
+        instlist holds (number, name) pairs in the top-to-bottom sequence of instruments
+        printseq indicates the top-to-bottom sequence of drum instruments
+        opts indicates how many events per line and whether to print "empty" lines
+        """
+        interval, clear_empty = opts
+        total_length = sum(self.play_lengths)
+        windows = [iter_lines([self.all_note_tracks[x][y] for y in self.all_notes[x]],
+                              total_length, interval, eventsep(False, self.short_format),
+                              clear_empty) for x, _ in instlist]
+        windows.append(iter_lines([self.all_drum_tracks[x] for x in printseq], total_length,
+                                  interval, eventsep(True, self.short_format), clear_empty))
+        for *inst_lines, drum_lines in zip(*windows):
+            for (_, name), lines in zip(instlist, inst_lines):
+                print(f'{name}:', file=_out)
+                print_lines(lines, empty_note, _out, '  ')
+            print('drums:', file=_out)
+            print_lines(drum_lines, empty_drums, _out, '  ')
+            print('', file=_out)
+
+
 def build_header(filetype, filename, text=''):
     """return standard header for "general" file
     """
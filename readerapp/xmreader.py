@@ -3,6 +3,7 @@
 import sys
 import struct
 import collections
+import functools
 import contextlib
 import logging
 from readerapp import shared
@@ -34,18 +35,52 @@ def read_string(stream, length):
     return result.rstrip('\x20\x00')
 
 
-class ExtModule:
+# for each possible first byte of a packed event: the positions of the values that follow
+# it in the (note, instrument, volume, effect, parameter) event
+packed_fields = [tuple(ix for ix in range(5) if flag & (1 << ix)) for flag in range(128)]
+
+
+def get_pattern_rows(data, rows, channel_count):
+    """decode (packed) pattern data read from file
+
+    yields the position of each row in the data and the row's events,
+    stops after the row containing a pattern break (effect 13)
+    """
+    pos = 0
+    for _ in range(rows):
+        rowpos = pos
+        rowdata = []
+        for _ in range(channel_count):
+            start_byte = data[pos]
+            if start_byte & 0x80:
+                fields = packed_fields[start_byte & 0x7F]
+                event = [0, 0, 0, 0, 0]
+                for ix, field in enumerate(fields, start=pos + 1):
+                    event[field] = data[ix]
+                rowdata.append(tuple(event))
+                pos += len(fields) + 1
+            else:
+                rowdata.append(tuple(data[pos:pos + 5]))
+                pos += 5
+        yield rowpos, rowdata
+        if any(event[3] == 13 for event in rowdata):
+            break
+
+
+class ExtModule(shared.TrackerModule):
     """Main processing class
+
+    progress, if given, is called for each pattern read, see read()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, progress=None):
         self.filename = filename
         self.pattern_data = {}
         self._pattern_map = {}
-        self.pattern_lengths = []
+        self.play_lengths = []
         self.instruments = {}
         self.short_format = None
         self.show_continual = None
-        self.read()
+        self.read(progress)
 
         # pattern list en map bijwerken met uitgesplitste
         original_pattern_map = self._raw_pattern_map
@@ -63,8 +98,8 @@ class ExtModule:
             self._pattern_list.extend(renumber[patt])
 
         # pattern data decoderen
-        self._pattern_data = collections.defaultdict(lambda: collections.defaultdict(
-            lambda: collections.defaultdict(list)))
+        self._pattern_data = collections.defaultdict(functools.partial(
+            collections.defaultdict, functools.partial(collections.defaultdict, list)))
         sampledata_found = collections.defaultdict(lambda: False)
         self.initial_patterns = {}
         for pattstart, pattdata in self._raw_pattern_data.items():
@@ -102,11 +137,14 @@ class ExtModule:
                 samples_to_keep.append((ix, samp))
         self.samplenames = samples_to_keep
 
-    def read(self):
+    @shared.instrumented
+    def read(self, progress=None):
         """read the file via structures into an internal data collection
 
         instead of repositioning while reading, why not read the entire file first
         and then (re)position in memory?
+        progress, if given, is called with a description of each pattern before reading it;
+        it can stop the reading by raising an exception
         """
         with open(self.filename, 'rb') as _xm:
 
@@ -126,48 +164,30 @@ class ExtModule:
 
             self._raw_pattern_data = {}
             pattstart = header_size + 60
+            trace = logging.getLogger().isEnabledFor(logging.DEBUG)
             for pattnum in range(pattern_count):
+                if progress:
+                    progress(f'reading pattern {pattnum + 1} of {pattern_count}')
                 _xm.seek(pattstart)        # position at start of pattern header
                 size, _, rows, data_size = struct.unpack('<LBHH', _xm.read(9))
-                log(f'pattern {pattnum} at {hex(pattstart)}; {size=} {rows=} {data_size=}')
+                if trace:
+                    logging.debug(f'pattern {pattnum} at {hex(pattstart)}; {size=} {rows=}'
+                                  f' {data_size=}')
                 orig_pattstart = pattstart
                 pattstart += size
                 self._raw_pattern_map[pattstart] = pattnum
                 _xm.seek(pattstart)     # position at start of pattern data
+                datastart = pattstart
                 pattdata = []
                 if data_size > 0:
-                    for rownum in range(rows):
+                    rows_found = get_pattern_rows(_xm.read(data_size), rows, channel_count)
+                    for rownum, (rowpos, rowdata) in enumerate(rows_found):
                         if rownum and rownum % shared.max_lines == 0:
                             self._raw_pattern_data[pattstart] = pattdata
-                            pattstart = _xm.tell()
+                            pattstart = datastart + rowpos
                             ## log('started new pattern at {}'.format(hex(pattstart)))
                             pattdata = []
-                        rowdata = []
-                        endpattern = False
-                        for _ in range(channel_count):
-                            start_byte = struct.unpack('B', _xm.read(1))[0]
-                            compressed = start_byte & 0x80
-                            note = inst = vol = eff = parm = 0
-                            if not compressed:
-                                note = start_byte
-                            elif start_byte & 0x01:
-                                note = struct.unpack('B', _xm.read(1))[0]
-                            if not compressed or start_byte & 0x02:
-                                inst = struct.unpack('B', _xm.read(1))[0]
-                            if not compressed or start_byte & 0x04:
-                                vol = struct.unpack('B', _xm.read(1))[0]
-                            if not compressed or start_byte & 0x08:
-                                eff = struct.unpack('B', _xm.read(1))[0]
-                            if not compressed or start_byte & 0x10:
-                                parm = struct.unpack('B', _xm.read(1))[0]
-                            ## log('{}, {}, {}, {}, {}, {}, {}, {}'.format(pattnum,
-                                ## rownum, channel, note, inst, vol, eff, parm))
-                            rowdata.append((note, inst, vol, eff, parm))
-                            if eff == 13:
-                                endpattern = True
                         pattdata.append(rowdata)
-                        if endpattern:
-                            break
                 self._raw_pattern_data[pattstart] = pattdata
                 pattstart = orig_pattstart + size + data_size     # calculate next pattern start
 
@@ -194,14 +214,15 @@ class ExtModule:
                     self.instruments[instnum + 1][0] = samples[0][0].split('.')[0]
                 self.instruments[instnum + 1].append(samples)
 
-    def process(self, gui):
+    def process(self, options):
         """create output for eXtended Module
         """
+        self.short_format = options.short_format
+        self.show_continual = options.full
         drums = []
         nondrums = []
-        samples, letters, printseq = gui.assigned
-        samples_2 = [gui.list_samples.item(x).text().split()[0] for x in range(
-            len(gui.list_samples))]
+        samples, letters, printseq = options.drumsamples, options.letters, options.printseq
+        samples_2 = [x.split()[0] for x in options.instruments]
 
         for num, name in enumerate(self.samplenames):
             name = name[1]
@@ -212,59 +233,45 @@ class ExtModule:
                 ix = samples_2.index(name)
                 nondrums.append((num + 1, name))
 
-        with open(gui.get_general_filename(), "w") as out:
+        with options.open_output(options.names.get_general_filename(), 'w') as out:
             if drums:
                 self.print_general_data(drums, self.show_continual, out)
             else:
                 self.print_general_data(full=self.show_continual, _out=out)
         self.prepare_print_instruments(nondrums)
         self.prepare_print_drums(printseq)
-        options = (gui.max_events.value(), gui.check_nonempty.isChecked())
-        if gui.check_allinone.isChecked():
-            with open(gui.get_general_filename(), 'a') as _out:
-                nondrums = [(x + 1, y) for x, y in enumerate(gui.list_items(gui.list_samples))]
-                self.print_all_instruments_full(nondrums, printseq, options, _out)
+        opts = (options.max_events, options.crop_empty)
+        if options.all_in_one:
+            with options.open_output(options.names.get_general_filename(), 'a') as _out:
+                inst2sam = {y: x for x, y in self.samplenames}
+                nondrums = [(inst2sam[x], x) for x in options.instruments]
+                self.print_all_instruments_full(nondrums, printseq, opts, _out)
             return []
         if drums:
-            with open(gui.get_drums_filename(), "w") as out:
-                if gui.check_full.isChecked():
-                    ## self.print_drums_full(drums, printseq, options, out)
-                    self.print_drums_full(printseq, options, out)
+            with options.open_output(options.names.get_drums_filename(), 'w') as out:
+                if options.full:
+                    ## self.print_drums_full(drums, printseq, opts, out)
+                    self.print_drums_full(printseq, opts, out)
                 else:
                     ## self.print_drums(drums, printseq, out)
                     self.print_drums(printseq, out)
         for number, name in nondrums:
-            with open(gui.get_instrument_filename(name), "w") as out:
-                if gui.check_full.isChecked():
-                    self.print_instrument_full(number, options, out)
+            with options.open_output(options.names.get_instrument_filename(name), 'w') as out:
+                if options.full:
+                    self.print_instrument_full(number, opts, out)
                 else:
                     self.print_instrument(number, out)
         return []
 
+    @shared.instrumented
     def remove_duplicate_patterns(self, sampnum):
         """show patterns only once for incontiguous timelines
         """
-        renumber = {}
-        pattern_list = []
-        ## newsampnum = self.instruments[sampnum][0]
-        for pattnum, data in self._pattern_data.items():
-            for sampno, patt in data.items():
-                if sampno != sampnum:
-                    continue
-                try:
-                    new_pattnum = pattern_list.index(patt) + 1
-                except ValueError:
-                    pattern_list.append(patt)
-                    new_pattnum = len(pattern_list)
-                renumber[pattnum] = new_pattnum
-        self.pattern_data[sampnum] = pattern_list
-
-        for seq in self._pattern_list:
-            if seq in renumber:
-                self.playseqs[sampnum].append(renumber[seq])
-            else:
-                self.playseqs[sampnum].append(-1)
+        self.renumber_patterns(sampnum, ((pattnum, data[sampnum])
+                                         for pattnum, data in self._pattern_data.items()
+                                         if sampnum in data), self._pattern_list)
 
+    @shared.instrumented
     def remove_duplicate_drum_patterns(self, samplist):
         """show patterns only once for incontiguous timelines
 
@@ -272,64 +279,11 @@ class ExtModule:
         to print on this event, e.g. ((1, 'b'), (2, 's'), (4, 'bs'), (7, 'bsh'))
         """
         inst2samp = {x: y[0] for x, y in enumerate(self.samplenames)}
-        ## samp2inst = {y[0]: x for x, y in enumerate(self.samplenames)}
-        single_instrument_samples = [inst2samp[x - 1] for x, y in samplist
-                                     if len(y) == 1]
-        ## lookup = {y: inst2samp[x - 1] for x, y in samplist if len(y) == 1}
         samp2lett = {inst2samp[x - 1]: y for x, y in samplist}
-        drumpatterns = collections.defaultdict(lambda: collections.defaultdict(list))
-        self.pattlengths = collections.defaultdict(dict)
-
-        for pattnum, data in self._pattern_data.items():
-            ## print(data)
-            for sampnum, patt in data.items():
-                if sampnum not in single_instrument_samples:
-                    continue
-                samplett = samp2lett[sampnum]
-                drumpatterns[pattnum]['len'].append((samplett, patt['len']))
-                # theoretisch kan dit data voor meer toonhoogten bevatten
-                # maar voor mijn spullen kan ik uitgaan van één
-                drumpatterns[pattnum][samplett] = [y for x, y in patt.items()
-                                                   if x != 'len'][0]
-
-        for pattnum, data in self._pattern_data.items():
-            for sampnum, patt in data.items():
-                if sampnum in single_instrument_samples:
-                    continue
-                try:
-                    instletters = samp2lett[sampnum]
-                except KeyError:
-                    continue
-
-                for letter in instletters:
-                    drumpatterns[pattnum]['len'].append((letter, patt['len']))
-                    # theoretisch kan dit data voor meer toonhoogten bevatten
-                    # maar voor mijn spullen kan ik uitgaan van één
-                    drumpatterns[pattnum][letter].extend([y for x, y in patt.items()
-                                                          if x != 'len'][0])
-                    drumpatterns[pattnum][letter].sort()
-
-        renumber = {}
-        pattern_list = []
-        for pattnum, patt in drumpatterns.items():
-            lengths = [x[1] for x in patt['len']]
-            if max(lengths) != lengths[0] or min(lengths) != lengths[0]:
-                print(f'ongelijke lengtes in pattern {pattnum}: {self.pattlengths[pattnum]}')
-            patt['len'] = lengths[0]
-
-            try:
-                new_pattnum = pattern_list.index(patt) + 1
-            except ValueError:
-                pattern_list.append(patt)
-                new_pattnum = len(pattern_list)
-            renumber[pattnum] = new_pattnum
-        self.pattern_data['drums'] = pattern_list
-        for seq in self._pattern_list:
-            if seq in renumber:
-                self.playseqs['drums'].append(renumber[seq])
-            else:
-                self.playseqs['drums'].append(-1)
+        drumpatterns = self.merge_drum_patterns(self._pattern_data, samp2lett)
+        self.renumber_patterns('drums', drumpatterns.items(), self._pattern_list)
 
+    @shared.instrumented
     def print_general_data(self, sample_list=None, full=False, _out=sys.stdout):
         """create the "overview" file (sample and pattern lists)
         """
@@ -370,8 +324,7 @@ class ExtModule:
                     elif pattlens[ix] != pattlen:
                         print('Alarm! Verschillende lengtes voor pattern event', ix,
                               file=_out)
-        self.pattern_lengths = pattlens
-        self.full_length = sum(x for x in self.pattern_lengths)
+        self.play_lengths = pattlens
 
         if not full:
             data.extend(shared.build_patt_header())
@@ -386,6 +339,7 @@ class ExtModule:
         for text in data:
             print(text.rstrip(), file=_out)
 
+    @shared.instrumented
     def print_drums(self, printseq, _out=sys.stdout):
         """collect the drum sample events and print them together
 
@@ -394,7 +348,7 @@ class ExtModule:
         """
         for pattnum, pattern in enumerate(self.pattern_data['drums']):
             print(shared.patt_start.format(pattnum + 1), file=_out)
-            pattlen = pattern.pop('len')
+            pattlen = pattern['len']
             for inst in printseq:
                 for key, events in pattern.items():
                     if key == inst and events:
@@ -405,6 +359,7 @@ class ExtModule:
                         print('', file=_out)
             print('', file=_out)
 
+    @shared.instrumented
     def print_instrument(self, sample, _out=sys.stdout):
         """print the events for an instrument as a piano roll
 
@@ -413,8 +368,8 @@ class ExtModule:
         """
         for pattnum, pattern in enumerate(self.pattern_data[sample]):
             print(shared.patt_start.format(pattnum + 1), file=_out)
-            pattlen = pattern.pop('len')
-            for note in reversed(sorted(list(pattern))):
+            pattlen = pattern['len']
+            for note in reversed(sorted(x for x in pattern if x != 'len')):
                 events = pattern[note]
                 if events:
                     print(shared.line_start, end='', file=_out)
@@ -429,158 +384,7 @@ class ExtModule:
                     print(' '.join(printable), file=_out)
             print('', file=_out)
 
-    def prepare_print_drums(self, printseq):
-        """build complete timeline for drum instrument events
-        """
-        self.all_drum_events = collections.defaultdict(list)
-        # print(self.initial_patterns, file=_out)
-        for pattseq, pattnum in enumerate(self.playseqs['drums']):
-            pattlen = self.pattern_lengths[pattseq]
-            initial_patt = pattlen * [shared.empty_drums]
-            for inst in printseq:
-                pattdata = initial_patt[:]
-                if pattnum > -1:
-                    for event in range(pattlen):
-                        if event in self.pattern_data['drums'][pattnum - 1][inst]:
-                            pattdata[event] = inst
-                self.all_drum_events[inst].extend(pattdata)
-
-    def print_drums_full(self, printseq, opts, _out=sys.stdout):
-        """output the drums timeline to a separate file/stream
-
-        printseq indicates the top-to-bottom sequence of instruments
-        opts indicates how many events per line and whether to print "empty" lines
+    def get_note_label(self, note):
+        """return the text to show for a note in the timelines
         """
-        interval, clear_empty = opts
-        if self.short_format:
-            interval *= 2
-        sep = shared.eventsep(True, self.short_format)
-        empty = interval * shared.empty_drums
-
-        for eventindex in range(0, self.full_length, interval):
-            if eventindex + interval > self.full_length:
-                empty = (self.full_length - eventindex) * shared.empty_drums
-            not_printed = True
-            for inst in printseq:
-                line = sep.join(self.all_drum_events[inst][eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_drums, file=_out)
-            print('', file=_out)
-
-    def prepare_print_instruments(self, samplist):
-        """build complete timeline for all regular instrument events
-        """
-        self.all_note_tracks = collections.defaultdict(
-            lambda: collections.defaultdict(list))
-        self.all_notes = collections.defaultdict(set)
-        for sample, _ in samplist:  # sampname
-
-            ## pattdict = collections.defaultdict(lambda: collections.defaultdict(list))
-            for pattern in self.pattern_data[sample]:
-                self.all_notes[sample].update(pattern.keys())
-            self.all_notes[sample].discard('len')
-            self.all_notes[sample] = list(reversed(sorted(self.all_notes[sample])))
-
-            for pattseq, pattnum in enumerate(self.playseqs[sample]):
-                pattlen = self.pattern_lengths[pattseq]
-                if pattnum == -1:
-                    for note in self.all_notes[sample]:
-                        self.all_note_tracks[sample][note].extend(
-                            [shared.empty_note] * pattlen)
-                    continue
-                pattern = self.pattern_data[sample][pattnum - 1]
-                for note in self.all_notes[sample]:
-                    events = pattern[note]
-                    for i in range(pattlen):
-                        if i in events:
-                            to_append = shared.get_note_name(
-                                ## note + shared.octave_length - 1)
-                                note - 1)
-                        else:
-                            to_append = shared.empty_note
-                        self.all_note_tracks[sample][note].append(to_append)
-
-    def print_instrument_full(self, sample, opts, _out=sys.stdout):
-        """output an instrument timeline to a separate file/stream
-
-        trackno indicates the instrument to process
-        opts indicates how many events per line and whether to print "empty" lines
-        """
-        interval, clear_empty = opts
-        sep = shared.eventsep(False, self.short_format)
-        empty = sep.join(interval * [shared.empty_note])
-
-        for eventindex in range(0, self.full_length, interval):
-            if eventindex + interval > self.full_length:
-                empty = sep.join(
-                    (self.full_length - eventindex) * [shared.empty_note])
-            not_printed = True
-            for note in self.all_notes[sample]:
-                tracknotes = self.all_note_tracks[sample][note]
-                line = sep.join(tracknotes[eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print(line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print(shared.empty_note, file=_out)
-            print('', file=_out)
-
-    def print_all_instruments_full(self, samplist, printseq, opts, _out=sys.stdout):
-        """output all instrument timelines to the "general" file
-
-        samplist indicates the top-to-bottom sequence of instruments
-        printseq indicates the top-to-bottom sequence of drum instruments
-        opts indicates how many events per line and whether to print "empty" lines
-        """
-        interval, clear_empty = opts
-
-        inst2sam = {y: x for x, y in self.samplenames}
-        for eventindex in range(0, self.full_length, interval):
-
-            sep = shared.eventsep(False, self.short_format)
-            empty = sep.join(interval * [shared.empty_note])
-            if eventindex + interval > self.full_length:
-                empty = sep.join(
-                    (self.full_length - eventindex) * [shared.empty_note])
-            for _, sampname in samplist:
-                print(f'{sampname}:', file=_out)
-                sample = inst2sam[sampname]
-                not_printed = True
-                for note in self.all_notes[sample]:
-                    tracknotes = self.all_note_tracks[sample][note]
-                    line = sep.join(tracknotes[eventindex:eventindex + interval])
-                    if clear_empty and (line == empty or not line):
-                        pass
-                    else:
-                        print('  ', line, file=_out)
-                        not_printed = False
-                if not_printed:
-                    print('  ', shared.empty_note, file=_out)
-                print('', file=_out)
-
-            sep = shared.eventsep(True, self.short_format)
-            empty = interval * shared.empty_drums
-            if eventindex + interval > self.full_length:
-                empty = (self.full_length - eventindex) * shared.empty_drums
-            print('drums:', file=_out)
-            not_printed = True
-            for inst in printseq:
-                tracknotes = self.all_drum_events[inst]
-                line = sep.join(tracknotes[eventindex:eventindex + interval])
-                if clear_empty and (line == empty or not line):
-                    pass
-                else:
-                    print('  ', line, file=_out)
-                    not_printed = False
-            if not_printed:
-                print('  ', shared.empty_drums, file=_out)
-            print('', file=_out)
-
-            print('', file=_out)
+        return shared.get_note_name(note - 1)